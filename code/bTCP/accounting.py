@@ -0,0 +1,68 @@
+from collections import Counter, OrderedDict
+import time
+
+from typing import Dict
+
+
+class StateAccounting(object):
+    """Wall and CPU time, iterations and transitions per State subclass.
+
+    Time is attributed to the state the state machine was in while it
+    passed, so waiting for the network counts towards wall time only.
+    """
+
+    def __init__(self, state):
+        self.cpu = Counter()  # type: Dict[str, float]
+        self.iterations = Counter()  # type: Dict[str, int]
+        self.transitions = Counter()  # type: Dict[str, int]
+        self.wall = Counter()  # type: Dict[str, float]
+        self.state = type(state).__name__
+        self.since = time.perf_counter()
+        self.cpu_since = time.process_time()
+
+    def iteration(self, state):
+        self.iterations[type(state).__name__] += 1
+
+    def transition(self, old, new):
+        self.settle()
+        self.state = type(new).__name__
+        self.transitions[
+            "{} -> {}".format(type(old).__name__, self.state)
+        ] += 1
+
+    def settle(self):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.wall[self.state] += wall - self.since
+        self.cpu[self.state] += cpu - self.cpu_since
+        self.since = wall
+        self.cpu_since = cpu
+
+    def report(self) -> dict:
+        self.settle()
+        states = OrderedDict()
+        for state in sorted(self.wall, key=self.wall.get, reverse=True):
+            states[state] = {
+                "wall_seconds": self.wall[state],
+                "cpu_seconds": self.cpu[state],
+                "iterations": self.iterations[state],
+            }
+        return {
+            "states": states,
+            "transitions": dict(self.transitions),
+        }
+
+    def format(self) -> str:
+        report = self.report()
+        lines = ["{:<16} {:>12} {:>12} {:>10}".format(
+            "state", "wall (s)", "cpu (s)", "iterations"
+        )]
+        for state, row in report["states"].items():
+            lines.append("{:<16} {:>12.6f} {:>12.6f} {:>10}".format(
+                state, row["wall_seconds"], row["cpu_seconds"],
+                row["iterations"],
+            ))
+        lines.append("")
+        for transition, count in sorted(report["transitions"].items()):
+            lines.append("{:<33} {:>10}".format(transition, count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,273 @@
+import asyncio
+import socket
+
+from typing import Callable, Dict
+
+from bTCP.client import Client
+from bTCP.listener import Listener, upload_path
+from bTCP.server import Server
+from bTCP.state_machine import StateMachine
+from bTCP.transport import Address
+
+
+class Driver(object):
+    """Runs one StateMachine on an asyncio event loop."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        state_machine: StateMachine,
+        transport: asyncio.DatagramTransport,
+        finished: asyncio.Future,
+    ):
+        self.loop = loop
+        self.state_machine = state_machine
+        self.transport = transport
+        self.finished = finished
+        self.timer = None
+
+    def receive(self, data: bytes, address: Address):
+        self.state_machine.receive_datagram(data, self.loop.time(), address)
+        self.step()
+
+    def on_timer(self):
+        self.timer = None
+        self.state_machine.handle_timer(self.loop.time())
+        self.step()
+
+    def step(self):
+        sm = self.state_machine
+        for data, address in sm.datagrams_to_send():
+            self.transport.sendto(data, address)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if sm.state is sm.finished:
+            if not self.finished.done():
+                self.finished.set_result(sm)
+            return
+        deadline = sm.next_deadline()
+        if deadline is not None:
+            self.timer = self.loop.call_at(deadline, self.on_timer)
+
+    def cancel(self, exception: Exception):
+        if self.timer is not None:
+            self.timer.cancel()
+        if not self.finished.done():
+            self.finished.set_exception(exception)
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: Client, finished: asyncio.Future):
+        self.client = client
+        self.finished = finished
+        self.driver = None
+
+    def connection_made(self, transport):
+        self.driver = Driver(
+            asyncio.get_running_loop(), self.client, transport, self.finished
+        )
+        self.driver.on_timer()
+
+    def datagram_received(self, data, address):
+        self.driver.receive(data, address)
+
+    def error_received(self, exception):
+        pass
+
+    def connection_lost(self, exception):
+        self.driver.cancel(exception or ConnectionError("transport closed"))
+
+
+async def send_bytes(
+    address: Address,
+    input_bytes: bytes,
+    window: int=100,
+    timeout: float=0.1,
+    retry_limit: int=100,
+    output_file: str="",
+) -> Client:
+    loop = asyncio.get_running_loop()
+    client = Client(
+        None, input_bytes, address, window, timeout, retry_limit, output_file,
+    )
+    finished = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ClientProtocol(client, finished), family=socket.AF_INET,
+    )
+    try:
+        await finished
+    finally:
+        transport.close()
+    return client
+
+
+async def send_file(
+    address: Address,
+    path: str,
+    window: int=100,
+    timeout: float=0.1,
+    retry_limit: int=100,
+    output_file: str="",
+) -> Client:
+    def read() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+    input_bytes = await asyncio.get_running_loop().run_in_executor(None, read)
+    return await send_bytes(
+        address, input_bytes, window, timeout, retry_limit, output_file,
+    )
+
+
+class Upload(object):
+    """A connection accepted by an UploadServer."""
+
+    def __init__(self, address: Address, server: Server):
+        self.address = address
+        self.server = server
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def output_file(self) -> str:
+        return self.server.output_file
+
+    @property
+    def completed(self) -> bool:
+        return self.done.done()
+
+    async def wait(self) -> "Upload":
+        await asyncio.shield(self.done)
+        return self
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    def __init__(
+        self,
+        make_server: Callable[[], Server],
+        directory: str,
+        uploads: asyncio.Queue,
+        max_connections: int=1024,
+        idle_timeout: float=30.0,
+    ):
+        self.directory = directory
+        self.listener = Listener(
+            None, make_server, max_connections, idle_timeout,
+            on_accept=self.accept, on_close=self.close,
+        )
+        self.uploads = uploads
+        self.accepted = {}  # type: Dict[Address, Upload]
+        self.timer = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        loop = asyncio.get_running_loop()
+        self.listener.receive_datagram(data, loop.time(), address)
+        self.step()
+
+    def on_timer(self):
+        self.timer = None
+        self.listener.handle_timer(asyncio.get_running_loop().time())
+        self.step()
+
+    def step(self):
+        for data, address in self.listener.datagrams_to_send():
+            self.transport.sendto(data, address)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        deadline = self.listener.next_deadline()
+        if deadline is not None:
+            self.timer = asyncio.get_running_loop().call_at(
+                deadline, self.on_timer
+            )
+
+    def accept(self, address: Address, server: Server):
+        server.output_file = upload_path(self.directory, server)
+        upload = Upload(address, server)
+        self.accepted[address] = upload
+        self.uploads.put_nowait(upload)
+
+    def close(self, address: Address, server: Server):
+        done = self.accepted.pop(address).done
+        if server.complete:
+            done.set_result(server)
+        else:
+            done.set_exception(ConnectionError("connection dropped"))
+
+    def error_received(self, exception):
+        pass
+
+    def connection_lost(self, exception):
+        if self.timer is not None:
+            self.timer.cancel()
+        for upload in self.accepted.values():
+            if not upload.done.done():
+                upload.done.set_exception(
+                    exception or ConnectionError("transport closed")
+                )
+        self.accepted.clear()
+        # ends the iteration of the UploadServer
+        self.uploads.put_nowait(None)
+
+
+class UploadServer(object):
+    """Accepts uploads from any number of clients on one UDP port.
+
+    Iterating asynchronously yields every accepted Upload as soon as its
+    handshake completes; await Upload.wait() for it to complete.
+    """
+
+    def __init__(
+        self,
+        transport: asyncio.DatagramTransport,
+        uploads: asyncio.Queue,
+    ):
+        self.transport = transport
+        self.uploads = uploads
+        self.address = transport.get_extra_info("sockname")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Upload:
+        upload = await self.uploads.get()
+        if upload is None:
+            # leave the end for any other iteration
+            self.uploads.put_nowait(None)
+            raise StopAsyncIteration
+        return upload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.transport.close()
+
+
+async def start_server(
+    local_address: Address,
+    directory: str=".",
+    window: int=100,
+    timeout: float=0.1,
+    retry_limit: int=10,
+    max_connections: int=1024,
+    idle_timeout: float=30.0,
+) -> UploadServer:
+    loop = asyncio.get_running_loop()
+    uploads = asyncio.Queue()
+
+    def make_server() -> Server:
+        return Server(None, timeout, retry_limit, window, "")
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ServerProtocol(
+            make_server, directory, uploads, max_connections, idle_timeout,
+        ),
+        local_addr=local_address,
+    )
+    return UploadServer(transport, uploads)
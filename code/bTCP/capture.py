@@ -0,0 +1,130 @@
+from collections import deque, namedtuple
+import struct
+import time
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bTCP import checksum
+from bTCP.exceptions import ChecksumMismatch
+from bTCP.message import BTCPMessage
+from bTCP.header import unwrap
+from bTCP.transport import Address, Transport
+
+Record = namedtuple("Record", ["timestamp", "direction", "data"])
+Event = namedtuple("Event", [
+    "timestamp", "direction", "message", "retransmission",
+])
+
+
+class Capture(object):
+    magic = b"bTCPcap1"
+    record_format = struct.Struct("!dBH")
+    sent = 0
+    received = 1
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int=4096,
+    ):
+        self.path = path
+        self.records = deque()
+        self.capacity = capacity
+        with open(path, "wb") as f:
+            f.write(Capture.magic)
+
+    def record(self, direction: int, data: bytes):
+        self.records.append((time.time(), direction, data))
+        if len(self.records) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        records = self.records
+        self.records = deque()
+        pack = Capture.record_format.pack
+        with open(self.path, "ab") as f:
+            for timestamp, direction, data in records:
+                f.write(pack(timestamp, direction, len(data)))
+                f.write(data)
+
+
+class CapturingTransport(Transport):
+    def __init__(self, transport: Transport, capture: Capture):
+        self.transport = transport
+        self.capture = capture
+
+    def sendto(self, data: bytes, address: Address) -> int:
+        self.capture.record(Capture.sent, data)
+        return self.transport.sendto(data, address)
+
+    def recv(self, bufsize: int) -> bytes:
+        data = self.transport.recv(bufsize)
+        self.capture.record(Capture.received, data)
+        return data
+
+    def recvfrom(self, bufsize: int) -> Tuple[bytes, Address]:
+        data, address = self.transport.recvfrom(bufsize)
+        self.capture.record(Capture.received, data)
+        return data, address
+
+    def settimeout(self, timeout: Optional[float]):
+        self.transport.settimeout(timeout)
+
+    def setblocking(self, flag: bool):
+        self.transport.setblocking(flag)
+
+    def close(self):
+        self.capture.flush()
+        self.transport.close()
+
+
+def read_capture(path: str) -> Iterator[Record]:
+    size = Capture.record_format.size
+    with open(path, "rb") as f:
+        if f.read(len(Capture.magic)) != Capture.magic:
+            raise ValueError("{} is not a bTCP capture.".format(path))
+        while True:
+            header = f.read(size)
+            if len(header) < size:
+                return
+            timestamp, direction, length = Capture.record_format.unpack(
+                header
+            )
+            yield Record(timestamp, direction, f.read(length))
+
+
+def decode(data: bytes) -> Optional[BTCPMessage]:
+    """Decode a captured datagram, whichever checksum it was sent with."""
+    for algorithm in checksum.algorithms.values():
+        try:
+            return BTCPMessage.from_bytes(data, algorithm)
+        except ChecksumMismatch:
+            continue
+        except struct.error:
+            return None
+    return None
+
+
+def timelines(records: Iterator[Record]) -> Dict[int, List[Event]]:
+    connections = {}
+    seen = set()
+    # the highest syn number per stream and direction, to undo the wrap
+    highest = {}  # type: Dict[Tuple[int, int], int]
+    for record in records:
+        message = decode(record.data)
+        if message is None:
+            continue
+        header = message.header
+        stream = (header.id, record.direction)
+        reference = highest.get(stream, header.syn_number)
+        syn_number = unwrap(header.syn_number, reference)
+        highest[stream] = max(reference, syn_number)
+        key = stream + (syn_number,)
+        pure_ack = header.ack and not (header.syn or header.fin)
+        retransmission = not pure_ack and key in seen
+        if not pure_ack:
+            seen.add(key)
+        connections.setdefault(header.id, []).append(Event(
+            record.timestamp, record.direction, message, retransmission,
+        ))
+    return connections
@@ -0,0 +1,51 @@
+import zlib
+
+from typing import Callable, Dict, Iterable, List, Optional
+
+Algorithm = Callable[[bytes, bytes], int]
+
+
+def crc32(header: bytes, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(header))
+
+
+def adler32(header: bytes, payload: bytes) -> int:
+    return zlib.adler32(payload, zlib.adler32(header))
+
+
+def header_only(header: bytes, payload: bytes) -> int:
+    """Only protects the header, for links that already check payloads."""
+    return zlib.crc32(header)
+
+
+# identifiers on the wire, a new algorithm takes the next free number
+algorithms = {
+    1: crc32,
+    2: adler32,
+    3: header_only,
+}  # type: Dict[int, Algorithm]
+names = {
+    "crc32": 1,
+    "adler32": 2,
+    "header": 3,
+}  # type: Dict[str, int]
+default = 1
+# the algorithms that also protect the payload
+payload_checked = (1, 2)
+
+
+def parse(text: str) -> List[int]:
+    """Turn a comma separated list of algorithm names into identifiers."""
+    try:
+        return [names[name.strip()] for name in text.split(",")]
+    except KeyError as e:
+        raise ValueError("unknown checksum algorithm {}".format(e))
+
+
+def choose(offered: bytes, accepted: Iterable[int]) -> Optional[int]:
+    """Pick the first offered algorithm that is also accepted."""
+    accepted = set(accepted)
+    for identifier in offered:
+        if identifier in accepted and identifier in algorithms:
+            return identifier
+    return None
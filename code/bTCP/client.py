@@ -1,75 +1,155 @@
 # author: Hendrik Werner s4549775
 # author: Constantin Blach s4329872
-from datetime import datetime
-from random import randint
-import socket
+from random import Random
 
-from typing import Tuple
+import struct
 
-from bTCP.exceptions import ChecksumMismatch
+from typing import Optional, Sequence, Tuple
+
+from bTCP import checksum
+from bTCP.exceptions import InvalidFrame
 from bTCP.message import BTCPMessage, MessageFactory
+from bTCP.header import unwrap
+from bTCP.options import Options
+from bTCP.pipeline import ReadAhead
 from bTCP.state_machine import State, StateMachine
+from bTCP.transport import Transport
 
 
 class Client(StateMachine):
     def __init__(
         self,
-        sock: socket.socket,
+        sock: Transport,
         input_bytes: bytes,
         destination_address: Tuple[str, int],
         window: int,
         timeout: float,
         retry_limit: int,
         output_file: str,
+        session: bool=False,
+        fastopen: bool=False,
+        fastopen_cookie: Optional[bytes]=None,
+        checksums: Sequence[int]=(checksum.default,),
+        read_ahead: Optional[ReadAhead]=None,
     ):
+        super().__init__(sock)
         self.closed = Client.Closed(self)
         self.syn_sent = Client.SynSent(self)
-        self.established = Client.Established(self, input_bytes, timeout)
-        self.fin_sent = Client.FinSent(self, retry_limit)
+        self.established = Client.Established(
+            self, input_bytes, retry_limit
+        )
+        self.time_wait = Client.TimeWait(self)
         self.fin_received = Client.FinReceived(self, retry_limit)
         self.finished = Client.Finished(self)
         self.state = self.closed
 
+        self.checksums = tuple(checksums)
         self.destination_address = destination_address
+        self.closed_at = None  # type: Optional[float]
         self.expected_syn = 0
         self.factory = MessageFactory(0, window)
+        self.fastopen = fastopen
+        self.fastopen_cookie = fastopen_cookie
+        self.handshake = None
         self.highest_ack = 0
         self.output_file = bytes(output_file, "utf-8")
+        self.random = Random()
+        self.read_ahead = read_ahead
+        self.retransmissions = 0
+        self.segments_sent = 0
         self.server_window = 0
-        self.sock = sock
-        self.sock.settimeout(timeout)
+        self.session = session
+        self.started_at = None  # type: Optional[float]
         self.stream_id = 0
         self.syn_number = 0
+        self.timeout = timeout
+
+    @property
+    def transfer_time(self) -> Optional[float]:
+        """Seconds from the first SYN to the server's FIN-ACK."""
+        if self.closed_at is None:
+            return None
+        return self.closed_at - self.started_at
 
     def accept_ack(self, ack: int):
         self.highest_ack = ack if ack > self.highest_ack else self.highest_ack
 
     class Closed(State):
-        def run(self):
+        def deadline(self):
+            return 0.0
+
+        def timer(self, now):
             sm = self.state_machine
-            sm.syn_number = randint(0, 2 ** 8)
-            stream_id = randint(0, 2 ** 32)
+            sm.started_at = now
+            sm.syn_number = sm.random.randint(0, 2 ** 8)
+            stream_id = sm.random.randint(0, 2 ** 32 - 1)
             sm.stream_id = stream_id
             sm.factory.stream_id = stream_id
             return sm.syn_sent
 
     class SynSent(State):
-        def run(self):
+        def __init__(self, state_machine: StateMachine):
+            super().__init__(state_machine)
+            # whether the SYN carries all of the input
+            self.fin = False
+            self.message = None
+            self.sent_at = 0.0
+
+        def enter(self, now):
             sm = self.state_machine
-            sm.sock.sendto(
-                sm.factory.syn_message(
+            if sm.fastopen or sm.checksums != (checksum.default,):
+                message = sm.factory.syn_message(
+                    sm.syn_number, sm.expected_syn, self.options()
+                )
+                message.header.name = False
+                message.header.options = True
+                message.header.fin = self.fin
+            else:
+                message = sm.factory.syn_message(
                     sm.syn_number, sm.expected_syn, sm.output_file
-                ).to_bytes(),
-                sm.destination_address,
-            )
-            try:
-                synack_message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.syn_sent
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.syn_sent
+                )
+            message.header.session = sm.session
+            sm.send(message, sm.destination_address)
+            self.message = message
+            self.sent_at = now
+            return self
+
+        def options(self) -> bytes:
+            sm = self.state_machine
+            options = Options()
+            if sm.output_file:
+                options[Options.name] = sm.output_file
+            if sm.checksums != (checksum.default,):
+                options[Options.checksum] = bytes(sm.checksums)
+            if not sm.fastopen:
+                return options.to_bytes()
+            # an empty cookie asks the server for one
+            options[Options.cookie] = sm.fastopen_cookie or b""
+            if sm.fastopen_cookie:
+                room = (
+                    BTCPMessage.payload_size - len(options.to_bytes()) -
+                    Options.format.size
+                )
+                # one byte more tells whether the data covers the input
+                if sm.read_ahead is None:
+                    data = sm.established.input_bytes[:room + 1]
+                else:
+                    data = sm.read_ahead.peek(room + 1)
+                self.fin = len(data) <= room
+                data = data[:room]
+                if data:
+                    options[Options.data] = data
+            return options.to_bytes()
+
+        def deadline(self):
+            return self.sent_at + self.state_machine.timeout
+
+        def timer(self, now):
+            self.log_error("timed out")
+            return self.enter(now)
+
+        def receive(self, synack_message, address, now):
+            sm = self.state_machine
             if not (
                 synack_message.header.id == sm.stream_id and
                 synack_message.header.syn and
@@ -77,126 +157,224 @@ class Client(StateMachine):
             ):
                 self.log_error("wrong message received")
                 return sm.syn_sent
+            if synack_message.header.options:
+                self.accept_options(synack_message.payload)
             sm.server_window = synack_message.header.window_size
             sm.accept_ack(synack_message.header.ack_number)
             sm.expected_syn = synack_message.header.syn_number + 1
             sm.syn_number += 1
-            sm.sock.sendto(
-                sm.factory.ack_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
-                sm.destination_address,
+            if synack_message.header.fin:
+                # the server accepted all of the input with the SYN
+                print("Connection established")
+                return sm.time_wait
+            # echo the SYN, so a server using SYN cookies can rebuild it
+            sm.handshake = sm.factory.message(
+                sm.syn_number, sm.expected_syn, self.message.payload
             )
+            sm.handshake.header.ack = True
+            sm.handshake.header.name = self.message.header.name
+            sm.handshake.header.session = self.message.header.session
+            sm.handshake.header.options = self.message.header.options
+            sm.send(sm.handshake, sm.destination_address)
+            if sm.read_ahead is not None:
+                sm.read_ahead.start(
+                    sm.factory, sm.syn_number, sm.expected_syn, sm.checksum,
+                    sm.established.input_offset,
+                )
             print("Connection established")
             return sm.established
 
+        def accept_options(self, payload: bytes):
+            sm = self.state_machine
+            try:
+                options = Options.from_bytes(payload)
+            except InvalidFrame:
+                self.log_error("invalid options received")
+                return
+            chosen = options.get(Options.checksum, b"")
+            if len(chosen) == 1 and chosen[0] in sm.checksums:
+                sm.checksum = checksum.algorithms[chosen[0]]
+            if Options.cookie in options:
+                sm.fastopen_cookie = options[Options.cookie]
+            if Options.accepted in options:
+                # the server already has this much of the input
+                sm.established.input_offset += struct.unpack(
+                    "!L", options[Options.accepted]
+                )[0]
+
     class Established(State):
         def __init__(
             self,
             state_machine: StateMachine,
             input_bytes: bytes,
-            timeout: float,
+            retry_limit: int,
         ):
             super().__init__(state_machine)
             self.input_bytes = input_bytes
+            self.input_offset = 0
+            self.fin_queued = False
+            # bounds retransmissions once the FIN is sent
+            self.retry_limit = retry_limit
+            self.retries = retry_limit
+            # ordered by the time each segment was last sent
             self.messages = {}
-            self.timeout = timeout
+            self.poll_at = None
+            self.probe_at = None
 
-        def run(self):
+        def enter(self, now):
             sm = self.state_machine
+            self.poll_at = None
             while (
-                self.input_bytes and
+                not self.fin_queued and
                 sm.syn_number < sm.highest_ack + sm.server_window
             ):
-                data = self.input_bytes[:BTCPMessage.payload_size]
-                self.input_bytes = self.input_bytes[
-                    BTCPMessage.payload_size:
-                ]
-                message = sm.factory.message(
-                    sm.syn_number, sm.expected_syn, data
-                )
-                sm.sock.sendto(message.to_bytes(), sm.destination_address)
-                self.messages[sm.syn_number] = (
-                    message, datetime.now().timestamp(),
-                )
-                sm.syn_number += 1
-            while sm.highest_ack < sm.syn_number:
-                try:
-                    message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-                except socket.timeout:
-                    self.log_error("timed out")
+                if not self.send_segment(now):
+                    # the reader is behind, try again once it caught up
+                    self.poll_at = now + ReadAhead.poll_interval
                     break
-                except ChecksumMismatch:
-                    self.log_error("checksum mismatch")
-                    continue
-                if message.header.id != sm.stream_id:
-                    continue
-                for syn_nr in range(sm.highest_ack, message.header.ack_number):
-                    del self.messages[syn_nr]
-                sm.accept_ack(message.header.ack_number)
-                if message.header.fin:
-                    sm.expected_syn += 1
-                    return sm.fin_received
-            for syn_nr in self.messages:
-                message, timestamp = self.messages[syn_nr]
-                now = datetime.now().timestamp()
-                if now - timestamp > self.timeout:
-                    message.header.ack_number = sm.expected_syn
-                    sm.sock.sendto(message.to_bytes(), sm.destination_address)
-                    self.messages[syn_nr] = (message, now)
-            if self.input_bytes or sm.highest_ack < sm.syn_number:
+            if (
+                not self.fin_queued and
+                not self.messages and
+                self.poll_at is None and
+                self.probe_at is None
+            ):
+                # the window is closed, probe it until it opens again
+                self.probe_at = now + sm.timeout
+            return sm.established
+
+        def send_segment(self, now: float) -> bool:
+            """Send the next segment, if it is available yet."""
+            sm = self.state_machine
+            if sm.read_ahead is None:
+                message = self.next_message()
+                data = message.to_bytes(sm.checksum)
+            else:
+                segment = sm.read_ahead.next()
+                if segment is None:
+                    return False
+                message, data = segment
+            # the last segment carries the FIN
+            self.fin_queued = message.header.fin
+            sm.send_datagram(data, sm.destination_address)
+            sm.segments_sent += 1
+            self.messages[sm.syn_number] = (message, now)
+            sm.syn_number += 1
+            return True
+
+        def next_message(self) -> BTCPMessage:
+            sm = self.state_machine
+            data = self.input_bytes[
+                self.input_offset:
+                self.input_offset + BTCPMessage.payload_size
+            ]
+            self.input_offset += len(data)
+            message = sm.factory.message(sm.syn_number, sm.expected_syn, data)
+            message.header.fin = self.input_offset >= len(self.input_bytes)
+            return message
+
+        def receive(self, message, address, now):
+            sm = self.state_machine
+            if message.header.id != sm.stream_id:
                 return sm.established
-            return sm.fin_sent
+            if message.header.syn:
+                # the server did not get the handshake ACK
+                if sm.handshake is not None:
+                    sm.send(sm.handshake, sm.destination_address)
+                return sm.established
+            sm.handshake = None
+            # the server is still there, if perhaps slow
+            self.retries = self.retry_limit
+            ack_number = unwrap(message.header.ack_number, sm.highest_ack)
+            if ack_number >= sm.highest_ack:
+                sm.server_window = message.header.window_size
+            for syn_nr in range(sm.highest_ack, ack_number):
+                self.messages.pop(syn_nr, None)
+            sm.accept_ack(ack_number)
+            if message.header.fin and message.header.ack:
+                if self.fin_queued and sm.highest_ack >= sm.syn_number:
+                    return sm.time_wait
+            elif message.header.fin:
+                sm.expected_syn += 1
+                return sm.fin_received
+            if sm.server_window:
+                self.probe_at = None
+            return self.enter(now)
 
-    class FinSent(State):
-        def __init__(
-            self,
-            state_machine: StateMachine,
-            retry_limit: int,
-        ):
+        def deadline(self):
+            deadlines = [self.poll_at, self.probe_at]
+            for message, timestamp in self.messages.values():
+                deadlines.append(timestamp + self.state_machine.timeout)
+                break
+            deadlines = [
+                deadline for deadline in deadlines if deadline is not None
+            ]
+            return min(deadlines) if deadlines else None
+
+        def timer(self, now):
+            sm = self.state_machine
+            if self.poll_at is not None and self.poll_at <= now:
+                return self.enter(now)
+            if not self.messages:
+                self.probe_at = None
+                if not self.send_segment(now):
+                    self.poll_at = now + ReadAhead.poll_interval
+                return sm.established
+            self.log_error("timed out")
+            if self.fin_queued:
+                if self.retries <= 0:
+                    self.log_error("retry limit reached")
+                    return sm.finished
+                self.retries -= 1
+            if sm.handshake is not None:
+                sm.send(sm.handshake, sm.destination_address)
+            for syn_nr, (message, timestamp) in list(self.messages.items()):
+                if timestamp + sm.timeout > now:
+                    break
+                message.header.ack_number = sm.expected_syn
+                sm.send(message, sm.destination_address)
+                sm.segments_sent += 1
+                sm.retransmissions += 1
+                del self.messages[syn_nr]
+                self.messages[syn_nr] = (message, now)
+            return sm.established
+
+    class TimeWait(State):
+        """Acknowledges the server's FIN-ACK, and repeats that for a bounded
+        time in case the acknowledgement is lost."""
+
+        def __init__(self, state_machine: StateMachine):
             super().__init__(state_machine)
-            self.retries = retry_limit
+            self.until = 0.0
 
-        def run(self):
+        def enter(self, now):
             sm = self.state_machine
-            if self.retries <= 0:
-                self.log_error("retry limit reached")
-                return sm.finished
-            self.retries -= 1
-            global syn_number
-            global expected_syn
-            sm.sock.sendto(
-                sm.factory.fin_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
+            sm.closed_at = now
+            sm.expected_syn += 1
+            self.until = now + 2 * sm.timeout
+            return self.acknowledge()
+
+        def acknowledge(self):
+            sm = self.state_machine
+            sm.send(
+                sm.factory.ack_message(sm.syn_number, sm.expected_syn),
                 sm.destination_address,
             )
-            try:
-                finack_message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.fin_sent
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.fin_sent
-            if not (
-                finack_message.header.id == sm.stream_id and
+            return sm.time_wait
+
+        def deadline(self):
+            return self.until
+
+        def timer(self, now):
+            return self.state_machine.finished
+
+        def receive(self, finack_message, address, now):
+            if (
+                finack_message.header.id == self.state_machine.stream_id and
                 finack_message.header.fin and
-                finack_message.header.ack and
-                finack_message.header.syn_number == sm.expected_syn
+                finack_message.header.ack
             ):
-                self.log_error("wrong message received")
-                return sm.fin_sent
-            sm.accept_ack(finack_message.header.ack_number)
-            sm.syn_number += 1
-            sm.expected_syn += 1
-            sm.sock.sendto(
-                sm.factory.ack_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
-                sm.destination_address,
-            )
-            return sm.finished
+                return self.acknowledge()
+            return self.state_machine.time_wait
 
     class FinReceived(State):
         def __init__(
@@ -206,31 +384,34 @@ class Client(StateMachine):
         ):
             super().__init__(state_machine)
             self.retries = retry_limit
+            self.sent_at = 0.0
 
-        def run(self):
+        def enter(self, now):
             sm = self.state_machine
             if self.retries <= 0:
                 self.log_error("retry limit reached")
                 return sm.finished
             self.retries -= 1
-            sm.sock.sendto(
-                sm.factory.finack_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
+            sm.send(
+                sm.factory.finack_message(sm.syn_number, sm.expected_syn),
                 sm.destination_address,
             )
-            try:
-                ack_message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.fin_received
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.fin_received
+            self.sent_at = now
+            return sm.fin_received
+
+        def deadline(self):
+            return self.sent_at + self.state_machine.timeout
+
+        def timer(self, now):
+            self.log_error("timed out")
+            return self.enter(now)
+
+        def receive(self, ack_message, address, now):
+            sm = self.state_machine
             if not (
                 ack_message.header.ack and
                 ack_message.header.id == sm.stream_id and
-                ack_message.header.syn_number == expected_syn
+                ack_message.header.syn_number == sm.expected_syn
             ):
                 self.log_error("wrong message received")
                 return sm.fin_received
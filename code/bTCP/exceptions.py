@@ -3,3 +3,7 @@
 
 class ChecksumMismatch(Exception):
     pass
+
+
+class InvalidFrame(Exception):
+    pass
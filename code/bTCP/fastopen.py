@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import json
+import os
+
+from typing import Optional
+
+from bTCP.transport import Address
+
+cookie_size = 8
+
+
+def make_cookie(key: bytes, address: Address) -> bytes:
+    return hmac.new(
+        key, address[0].encode("utf-8"), hashlib.sha256
+    ).digest()[:cookie_size]
+
+
+def valid_cookie(key: bytes, address: Address, cookie: bytes) -> bool:
+    return hmac.compare_digest(make_cookie(key, address), cookie)
+
+
+def load_key(path: str) -> bytes:
+    """Read the server's cookie key, creating it on first use so cookies
+    stay valid across server runs."""
+    if not os.path.exists(path):
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as f:
+            f.write(os.urandom(16))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class CookieCache(object):
+    """The cookies a client received, stored as JSON by server address."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cookies = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.cookies = json.load(f)
+
+    @staticmethod
+    def key(address: Address) -> str:
+        return "{}:{}".format(*address)
+
+    def get(self, address: Address) -> Optional[bytes]:
+        cookie = self.cookies.get(CookieCache.key(address))
+        return None if cookie is None else bytes.fromhex(cookie)
+
+    def set(self, address: Address, cookie: bytes):
+        self.cookies[CookieCache.key(address)] = cookie.hex()
+        with open(self.path, "w") as f:
+            json.dump(self.cookies, f)
@@ -5,6 +5,18 @@ import struct
 
 from pprint import pformat
 
+# syn and ack numbers are sent modulo this
+sequence_space = 2 ** 16
+
+
+def unwrap(number: int, reference: int) -> int:
+    """Find the sequence number closest to reference that was sent as
+    number."""
+    offset = (number - reference) % sequence_space
+    if offset >= sequence_space // 2:
+        offset -= sequence_space
+    return reference + offset
+
 
 class BTCPHeader(object):
     format = struct.Struct("!LHHBBH")
@@ -12,6 +24,8 @@ class BTCPHeader(object):
     ack_mask = 0b0010
     fin_mask = 0b0100
     name_mask = 0b1000
+    session_mask = 0b10000
+    options_mask = 0b100000
 
     @classmethod
     def from_bytes(cls, data: bytes):
@@ -102,11 +116,33 @@ class BTCPHeader(object):
         else:
             self._flags &= ~(BTCPHeader.name_mask)
 
+    @property
+    def session(self) -> bool:
+        return bool(self._flags & BTCPHeader.session_mask)
+
+    @session.setter
+    def session(self, on: bool) -> None:
+        if on:
+            self._flags |= BTCPHeader.session_mask
+        else:
+            self._flags &= ~(BTCPHeader.session_mask)
+
+    @property
+    def options(self) -> bool:
+        return bool(self._flags & BTCPHeader.options_mask)
+
+    @options.setter
+    def options(self, on: bool) -> None:
+        if on:
+            self._flags |= BTCPHeader.options_mask
+        else:
+            self._flags &= ~(BTCPHeader.options_mask)
+
     def to_bytes(self) -> bytes:
         return BTCPHeader.format.pack(
             self.id,
-            self.syn_number,
-            self.ack_number,
+            self.syn_number % sequence_space,
+            self.ack_number % sequence_space,
             self._flags,
             self.window_size,
             self.data_length,
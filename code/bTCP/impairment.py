@@ -0,0 +1,256 @@
+import heapq
+import random
+import selectors
+import socket
+import threading
+import time
+
+from typing import Dict, Optional, Tuple
+
+
+class CorrelatedRandom(object):
+    """Random numbers correlated with the previous one, like netem's."""
+
+    def __init__(self, rng: random.Random, correlation: float=0.0):
+        self.rng = rng
+        self.correlation = correlation
+        self.last = rng.random()
+
+    def __call__(self) -> float:
+        self.last = (
+            (1 - self.correlation) * self.rng.random() +
+            self.correlation * self.last
+        )
+        return self.last
+
+
+class BernoulliLoss(object):
+    def __init__(self, probability: float, correlation: float=0.0):
+        self.probability = probability
+        self.correlation = correlation
+
+    def model(self, rng: random.Random):
+        sample = CorrelatedRandom(rng, self.correlation)
+        return lambda: sample() < self.probability
+
+
+class GilbertElliottLoss(object):
+    """Two state burst loss model.
+
+    p is the probability to move from the good to the bad state, r the
+    probability to move back; good_loss and bad_loss are the loss
+    probabilities within each state.
+    """
+
+    def __init__(
+        self,
+        p: float,
+        r: float,
+        good_loss: float=0.0,
+        bad_loss: float=1.0,
+    ):
+        self.p = p
+        self.r = r
+        self.good_loss = good_loss
+        self.bad_loss = bad_loss
+
+    def model(self, rng: random.Random):
+        bad = False
+
+        def lost() -> bool:
+            nonlocal bad
+            if bad:
+                bad = rng.random() >= self.r
+            else:
+                bad = rng.random() < self.p
+            return rng.random() < (self.bad_loss if bad else self.good_loss)
+        return lost
+
+
+class Impairment(object):
+    """Network conditions applied to every datagram passing the proxy.
+
+    Probabilities are fractions, delay and jitter are in seconds and rate
+    is in bytes per second. Reordered packets skip the delay, as with
+    netem.
+    """
+
+    def __init__(
+        self,
+        loss=None,
+        duplicate: float=0.0,
+        corrupt: float=0.0,
+        delay: float=0.0,
+        jitter: float=0.0,
+        reorder: float=0.0,
+        reorder_correlation: float=0.0,
+        rate: Optional[float]=None,
+    ):
+        self.loss = loss
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_correlation = reorder_correlation
+        self.rate = rate
+
+
+def profiles(timeout: float=0.1) -> Dict[str, Impairment]:
+    """The network profiles of testframework.py."""
+    return {
+        "ideal": Impairment(),
+        "flipping": Impairment(corrupt=0.01),
+        "duplicates": Impairment(duplicate=0.1),
+        "lossy": Impairment(loss=BernoulliLoss(0.1, 0.25)),
+        "reordering": Impairment(
+            delay=0.02, reorder=0.25, reorder_correlation=0.5,
+        ),
+        "delayed": Impairment(delay=timeout, jitter=0.02),
+        "allbad": Impairment(
+            loss=BernoulliLoss(0.1, 0.25), duplicate=0.1, corrupt=0.01,
+            delay=0.02, reorder=0.25, reorder_correlation=0.5,
+        ),
+    }
+
+
+class Link(object):
+    """One direction of the proxy, with its own random stream."""
+
+    def __init__(self, impairment: Impairment, seed: int):
+        self.impairment = impairment
+        self.rng = random.Random(seed)
+        self.lost = (
+            impairment.loss.model(self.rng) if impairment.loss else None
+        )
+        self.reordered = CorrelatedRandom(
+            self.rng, impairment.reorder_correlation
+        )
+        self.free_at = 0.0
+
+    def schedule(self, data: bytes, now: float):
+        """Return the (delivery time, datagram) pairs for a datagram."""
+        impairment = self.impairment
+        rng = self.rng
+        if self.lost is not None and self.lost():
+            return []
+        copies = 2 if rng.random() < impairment.duplicate else 1
+        deliveries = []
+        for _ in range(copies):
+            datagram = data
+            if rng.random() < impairment.corrupt:
+                bit = rng.randrange(len(datagram) * 8)
+                datagram = bytearray(datagram)
+                datagram[bit // 8] ^= 1 << (bit % 8)
+                datagram = bytes(datagram)
+            departure = now
+            if impairment.rate:
+                departure = max(now, self.free_at) + (
+                    len(datagram) / impairment.rate
+                )
+                self.free_at = departure
+            if self.reordered() >= impairment.reorder:
+                departure += max(
+                    0.0,
+                    impairment.delay + rng.uniform(
+                        -impairment.jitter, impairment.jitter
+                    ),
+                )
+            deliveries.append((departure, datagram))
+        return deliveries
+
+
+class ImpairmentProxy(object):
+    """Forwards UDP datagrams between clients and a server while applying
+    an Impairment in both directions.
+
+    Clients send to the proxy's address. The proxy relays every client's
+    datagrams to the server from a socket of its own, and sends the server's
+    replies on that socket back to that client. All clients share the same
+    links, like they would share a bottleneck.
+    """
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        listen_address: Tuple[str, int]=("127.0.0.1", 0),
+        impairment: Impairment=None,
+        seed: int=0,
+    ):
+        self.server_address = server_address
+        self.clients = {}  # type: Dict[socket.socket, Tuple[str, int]]
+        self.upstreams = {}  # type: Dict[Tuple[str, int], socket.socket]
+        self.seed = seed
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(listen_address)
+        self.address = self.sock.getsockname()
+        # select.select cannot wait on descriptors past FD_SETSIZE, which
+        # the upstream sockets of many clients reach
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.impairment = impairment or Impairment()
+        self.queue = []
+        self.sequence = 0
+        self.running = False
+        self.thread = None
+
+    @property
+    def impairment(self) -> Impairment:
+        return self._impairment
+
+    @impairment.setter
+    def impairment(self, impairment: Impairment):
+        self._impairment = impairment
+        self.upstream = Link(impairment, self.seed)
+        self.downstream = Link(impairment, self.seed + 1)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for sock in self.clients:
+            sock.close()
+        self.sock.close()
+        self.selector.close()
+
+    def serve(self):
+        while self.running:
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, data, sock, address = heapq.heappop(self.queue)
+                sock.sendto(data, address)
+            wait = 0.1
+            if self.queue:
+                wait = min(wait, self.queue[0][0] - now)
+            for key, _ in self.selector.select(wait):
+                self.forward(key.fileobj)
+
+    def forward(self, sock: socket.socket):
+        try:
+            data, address = sock.recvfrom(65536)
+        except ConnectionError:
+            return
+        if sock is self.sock:
+            link = self.upstream
+            destination = self.server_address
+            sock = self.upstreams.get(address)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((self.address[0], 0))
+                self.upstreams[address] = sock
+                self.clients[sock] = address
+                self.selector.register(sock, selectors.EVENT_READ)
+        else:
+            link = self.downstream
+            destination = self.clients[sock]
+            sock = self.sock
+        for delivery, datagram in link.schedule(data, time.monotonic()):
+            heapq.heappush(self.queue, (
+                delivery, self.sequence, datagram, sock, destination,
+            ))
+            self.sequence += 1
@@ -0,0 +1,262 @@
+from collections import OrderedDict
+import hashlib
+import heapq
+import hmac
+import os
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bTCP.exceptions import ChecksumMismatch
+from bTCP.message import BTCPMessage
+from bTCP.header import BTCPHeader
+from bTCP.server import Server
+from bTCP.state_machine import StateMachine
+from bTCP.transport import Address, Transport
+
+
+class SynCookies(object):
+    """Encodes a handshake in the SYN-ACK's syn number.
+
+    A cookie depends on the client's address, stream id and syn number, and
+    on the current lifetime slot. It is valid in that slot and the next.
+    """
+    # leaves room below 2 ** 16 for the server's own syn numbers
+    limit = 2 ** 15
+
+    def __init__(self, key: bytes=None, lifetime: float=60.0):
+        self.key = os.urandom(16) if key is None else key
+        self.lifetime = lifetime
+
+    def cookie(
+        self,
+        address: Address,
+        stream_id: int,
+        syn_number: int,
+        slot: int,
+    ) -> int:
+        message = "{}|{}|{}|{}|{}".format(
+            address[0], address[1], stream_id, syn_number, slot
+        )
+        digest = hmac.new(
+            self.key, message.encode("utf-8"), hashlib.sha256
+        ).digest()
+        return int.from_bytes(digest[:4], "big") % SynCookies.limit
+
+    def make(self, address: Address, header: BTCPHeader, now: float) -> int:
+        slot = int(now // self.lifetime)
+        return self.cookie(address, header.id, header.syn_number, slot)
+
+    def valid(self, address: Address, header: BTCPHeader, now: float) -> bool:
+        """Check the cookie acknowledged by a handshake ACK."""
+        slot = int(now // self.lifetime)
+        return any(
+            self.cookie(
+                address, header.id, header.syn_number - 1, slot - age
+            ) + 1 == header.ack_number
+            for age in (0, 1)
+        )
+
+
+def upload_path(directory: str, server: Server) -> str:
+    """Where to store an upload accepted by a multi-client server."""
+    return os.path.join(
+        directory,
+        os.path.basename(server.output_file) or
+        "upload-{}".format(server.stream_id),
+    )
+
+
+class Listener(StateMachine):
+    """Serves any number of clients on one socket.
+
+    A connection is only allocated once the client acknowledges a valid SYN
+    cookie. Connections that stay idle for idle_timeout seconds are dropped,
+    as is the least recently active one when max_connections is reached.
+    Closed connections are remembered for as long as their cookie is valid,
+    so a late or duplicated handshake ACK cannot open them again.
+    on_accept is called with every new connection before it writes anything,
+    on_close when it finishes or is dropped.
+    """
+
+    def __init__(
+        self,
+        sock: Transport,
+        make_server: Callable[[], Server],
+        max_connections: int=1024,
+        idle_timeout: float=30.0,
+        cookies: SynCookies=None,
+        on_accept: Callable[[Address, Server], None]=None,
+        on_close: Callable[[Address, Server], None]=None,
+    ):
+        super().__init__(sock)
+        # (address, stream id) of closed connections, by when they closed
+        self.closed = OrderedDict()  # type: Dict[Tuple[Address, int], float]
+        self.closed_limit = 16 * max_connections
+        self.connections = OrderedDict()  # type: Dict[Address, Server]
+        self.cookies = SynCookies() if cookies is None else cookies
+        # every connection's next deadline, and a heap of them that may
+        # hold outdated entries
+        self.deadlines = {}  # type: Dict[Address, float]
+        self.timers = []  # type: List[Tuple[float, Address]]
+        self.idle_timeout = idle_timeout
+        self.last_active = {}  # type: Dict[Address, float]
+        self.make_server = make_server
+        self.max_connections = max_connections
+        self.on_accept = on_accept
+        self.on_close = on_close
+
+    def receive_datagram(
+        self,
+        data: bytes,
+        now: float,
+        address: Address=None,
+    ):
+        server = self.connections.get(address)
+        if server is not None:
+            self.connections.move_to_end(address)
+            self.last_active[address] = now
+            server.receive_datagram(data, now, address)
+            self.collect(address, server)
+            return
+        try:
+            message = BTCPMessage.from_bytes(data)
+        except ChecksumMismatch:
+            return
+        header = message.header
+        if header.syn and not header.ack:
+            self.answer(message, address, now)
+        elif header.ack and not header.syn:
+            self.forget(now)
+            if (
+                (address, header.id) not in self.closed and
+                self.cookies.valid(address, header, now)
+            ):
+                self.accept(message, address, now)
+
+    def answer(self, syn_message: BTCPMessage, address: Address, now: float):
+        """Send a SYN-ACK without keeping any state."""
+        server = self.new_server()
+        server.transition(server.state.receive(syn_message, address, now), now)
+        self.outbox += server.datagrams_to_send()
+
+    def accept(self, ack_message: BTCPMessage, address: Address, now: float):
+        header = ack_message.header
+        # the client echoes its SYN in the handshake ACK
+        syn_header = BTCPHeader(
+            id=header.id,
+            syn=header.syn_number - 1,
+            ack=0,
+            raw_flags=0,
+            window_size=header.window_size,
+        )
+        syn_header.syn = True
+        syn_header.name = header.name
+        syn_header.session = header.session
+        syn_header.options = header.options
+        server = self.new_server()
+        server.transition(
+            server.state.receive(
+                BTCPMessage(syn_header, ack_message.payload), address, now
+            ),
+            now,
+        )
+        if server.state is not server.syn_received:
+            return
+        server.datagrams_to_send()
+        server.syn_number = header.ack_number - 1
+        while len(self.connections) >= self.max_connections:
+            self.drop(next(iter(self.connections)))
+        self.connections[address] = server
+        self.last_active[address] = now
+        if self.on_accept is not None:
+            self.on_accept(address, server)
+        server.transition(server.state.receive(ack_message, address, now), now)
+        self.collect(address, server)
+
+    def new_server(self) -> Server:
+        server = self.make_server()
+        server.syn_cookies = self.cookies
+        return server
+
+    def collect(self, address: Address, server: Server):
+        self.outbox += server.datagrams_to_send()
+        if server.state is server.finished:
+            self.remove(address)
+        else:
+            self.schedule(address, server.next_deadline())
+
+    def schedule(self, address: Address, deadline: Optional[float]):
+        if deadline == self.deadlines.get(address):
+            return
+        if deadline is None:
+            del self.deadlines[address]
+            return
+        self.deadlines[address] = deadline
+        heapq.heappush(self.timers, (deadline, address))
+        if len(self.timers) > 2 * len(self.deadlines) + 64:
+            # drop the outdated entries
+            self.timers = [
+                (when, peer) for peer, when in self.deadlines.items()
+            ]
+            heapq.heapify(self.timers)
+
+    def next_timer(self) -> Optional[float]:
+        """The earliest deadline of any connection."""
+        timers = self.timers
+        while timers and self.deadlines.get(timers[0][1]) != timers[0][0]:
+            heapq.heappop(timers)
+        return timers[0][0] if timers else None
+
+    def drop(self, address: Address):
+        self.connections[address].abort()
+        self.remove(address)
+
+    def remove(self, address: Address):
+        server = self.connections.pop(address)
+        self.deadlines.pop(address, None)
+        # its cookie was made before the connection was last active
+        self.closed[(address, server.stream_id)] = self.last_active.pop(
+            address
+        )
+        while len(self.closed) > self.closed_limit:
+            self.closed.popitem(last=False)
+        if self.on_close is not None:
+            self.on_close(address, server)
+
+    def forget(self, now: float):
+        """Forget closed connections whose cookies have expired."""
+        expiry = 2 * self.cookies.lifetime
+        while self.closed:
+            key, closed_at = next(iter(self.closed.items()))
+            if closed_at + expiry > now:
+                break
+            del self.closed[key]
+
+    def handle_timer(self, now: float):
+        while self.connections:
+            address = next(iter(self.connections))
+            if self.last_active[address] + self.idle_timeout > now:
+                # connections are ordered by activity
+                break
+            server = self.connections[address]
+            server.state.log_error("idle, dropping connection")
+            self.drop(address)
+        while True:
+            deadline = self.next_timer()
+            if deadline is None or deadline > now:
+                break
+            _, address = heapq.heappop(self.timers)
+            del self.deadlines[address]
+            server = self.connections[address]
+            server.handle_timer(now)
+            self.collect(address, server)
+
+    def next_deadline(self) -> Optional[float]:
+        deadlines = [self.next_timer()]
+        for address in self.connections:
+            deadlines.append(self.last_active[address] + self.idle_timeout)
+            break
+        deadlines = [
+            deadline for deadline in deadlines if deadline is not None
+        ]
+        return min(deadlines) if deadlines else None
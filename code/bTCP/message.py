@@ -2,8 +2,7 @@
 # author: Constantin Blach s4329872
 import struct
 
-import zlib
-
+from bTCP import checksum
 from bTCP.exceptions import ChecksumMismatch
 from bTCP.header import BTCPHeader
 
@@ -12,11 +11,18 @@ class BTCPMessage(object):
     payload_size = 1000
 
     @classmethod
-    def from_bytes(cls, data: bytes):
+    def from_bytes(
+        cls,
+        data: bytes,
+        algorithm: checksum.Algorithm=checksum.crc32,
+    ):
         header = BTCPHeader.from_bytes(data[:12])
-        checksum = struct.unpack("!L", data[12:16])[0]
+        expected = struct.unpack("!L", data[12:16])[0]
         payload = data[16:16 + header.data_length]
-        if checksum == zlib.crc32(data[:12] + payload):
+        if header.syn or header.options:
+            # handshake segments are checked before anything is negotiated
+            algorithm = checksum.crc32
+        if expected == algorithm(data[:12], payload):
             return cls(header, payload)
         else:
             raise ChecksumMismatch()
@@ -47,10 +53,15 @@ class BTCPMessage(object):
             self.__dict__ == other.__dict__
         )
 
-    def to_bytes(self) -> bytes:
+    def to_bytes(
+        self,
+        algorithm: checksum.Algorithm=checksum.crc32,
+    ) -> bytes:
+        if self.header.syn or self.header.options:
+            algorithm = checksum.crc32
         header_bytes = self.header.to_bytes()
-        return header_bytes + struct.pack("!L", zlib.crc32(
-            header_bytes + self.payload
+        return header_bytes + struct.pack("!L", algorithm(
+            header_bytes, self.payload
         )) + self.payload.ljust(BTCPMessage.payload_size, b"\0")
 
 
@@ -113,8 +124,9 @@ class MessageFactory(object):
         self,
         syn_number: int,
         ack_number: int,
+        payload: bytes=b"",
     ) -> BTCPMessage:
-        message = self.message(syn_number, ack_number)
+        message = self.message(syn_number, ack_number, payload)
         message.header.syn = True
         message.header.ack = True
         return message
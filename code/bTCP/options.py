@@ -0,0 +1,34 @@
+import struct
+
+from bTCP.exceptions import InvalidFrame
+
+
+class Options(dict):
+    """Type-length-value options carried in SYN and SYN-ACK payloads."""
+    format = struct.Struct("!BH")
+    name = 1
+    cookie = 2
+    data = 3
+    accepted = 4
+    checksum = 5
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        options = cls()
+        offset = 0
+        while offset < len(data):
+            if offset + Options.format.size > len(data):
+                raise InvalidFrame("truncated option header")
+            kind, length = Options.format.unpack_from(data, offset)
+            offset += Options.format.size
+            if offset + length > len(data):
+                raise InvalidFrame("truncated option {}".format(kind))
+            options[kind] = bytes(data[offset:offset + length])
+            offset += length
+        return options
+
+    def to_bytes(self) -> bytes:
+        return b"".join(
+            Options.format.pack(kind, len(value)) + value
+            for kind, value in self.items()
+        )
@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+
+from typing import BinaryIO, Callable, Optional, Tuple
+
+from bTCP import checksum
+from bTCP.message import BTCPMessage, MessageFactory
+
+
+class ReadAhead(object):
+    """Reads and encodes a client's segments in a background thread.
+
+    Once the handshake fixes the stream id, syn numbers and checksum, start
+    begins reading the file from offset. Every segment is encoded as soon
+    as it is read and kept in a queue of at most depth segments, so the
+    network loop only has to send them. The last segment carries the FIN.
+    The network loop never waits for the reader: when the queue is empty
+    it tries again after poll_interval seconds.
+    """
+    poll_interval = 0.001
+
+    def __init__(self, file: BinaryIO, depth: int=256):
+        self.file = file
+        self.segments = queue.Queue(depth)
+        self.running = False
+        self.thread = None
+        self.error = None
+
+    def peek(self, size: int) -> bytes:
+        """Read the start of the file, before the thread is started."""
+        self.file.seek(0)
+        return self.file.read(size)
+
+    def start(
+        self,
+        factory: MessageFactory,
+        syn_number: int,
+        ack_number: int,
+        algorithm: checksum.Algorithm,
+        offset: int,
+    ):
+        self.file.seek(offset)
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.read,
+            args=(
+                MessageFactory(factory.stream_id, factory.window_size),
+                syn_number, ack_number, algorithm,
+            ),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def read(
+        self,
+        factory: MessageFactory,
+        syn_number: int,
+        ack_number: int,
+        algorithm: checksum.Algorithm,
+    ):
+        try:
+            data = self.file.read(BTCPMessage.payload_size)
+            while self.running:
+                following = self.file.read(BTCPMessage.payload_size)
+                message = factory.message(syn_number, ack_number, data)
+                message.header.fin = not following
+                self.segments.put((message, message.to_bytes(algorithm)))
+                if not following:
+                    return
+                data = following
+                syn_number += 1
+        except Exception as e:
+            self.error = e
+            self.segments.put((None, None))
+
+    def next(self) -> Optional[Tuple[BTCPMessage, bytes]]:
+        """Take the next segment, or None if it has not been read yet."""
+        try:
+            message, data = self.segments.get_nowait()
+        except queue.Empty:
+            return None
+        if message is None:
+            raise self.error
+        return message, data
+
+    def close(self):
+        self.running = False
+        # unblock the reader if the queue is full
+        while self.thread is not None and self.thread.is_alive():
+            try:
+                self.segments.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self.file.close()
+
+
+class Writer(object):
+    """Writes a server's output, in a background thread if depth is not 0.
+
+    Up to depth chunks wait in a queue for the thread, pending tells how
+    many. write never waits for the thread: the caller has to check full
+    first, and can try again after poll_interval seconds. Every write is
+    timed and passed to record. An error in the thread is raised by the
+    next call to write or close.
+    """
+    poll_interval = 0.001
+
+    def __init__(
+        self,
+        output,
+        record: Callable[[float], None],
+        depth: int=0,
+        clock: Callable[[], float]=time.perf_counter,
+    ):
+        self.clock = clock
+        self.output = output
+        self.record = record
+        self.error = None
+        self.chunks = queue.Queue(depth)
+        self.thread = None
+        if depth:
+            self.thread = threading.Thread(target=self.drain, daemon=True)
+            self.thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self.chunks.qsize()
+
+    @property
+    def full(self) -> bool:
+        return self.thread is not None and self.chunks.full()
+
+    def write(self, data: bytes):
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            self.timed_write(data)
+        else:
+            self.chunks.put_nowait(data)
+
+    def timed_write(self, data: bytes):
+        start = self.clock()
+        self.output.write(data)
+        self.record(self.clock() - start)
+
+    def drain(self):
+        while True:
+            data = self.chunks.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.timed_write(data)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        if self.thread is not None:
+            self.chunks.put(None)
+            self.thread.join()
+            self.thread = None
+        try:
+            self.output.close()
+        finally:
+            if self.error is not None:
+                raise self.error
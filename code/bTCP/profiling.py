@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+import cProfile
+import io
+import pstats
+import sys
+import tracemalloc
+
+from typing import Iterator, Optional
+
+from bTCP.accounting import StateAccounting
+from bTCP.state_machine import StateMachine
+
+kinds = ("states", "cprofile", "tracemalloc")
+
+
+@contextmanager
+def profile(
+    kind: Optional[str],
+    state_machine: StateMachine,
+    path: Optional[str]=None,
+    limit: int=30,
+) -> Iterator[None]:
+    """Profile the enclosed run of state_machine.
+
+    The report is written to path, or to stderr. Nothing is installed when
+    kind is None.
+    """
+    if kind is None:
+        yield
+    elif kind == "states":
+        state_machine.accounting = StateAccounting(state_machine.state)
+        try:
+            yield
+        finally:
+            write(state_machine.accounting.format(), path)
+            state_machine.accounting = None
+    elif kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            report = io.StringIO()
+            stats = pstats.Stats(profiler, stream=report)
+            stats.sort_stats("cumulative").print_stats(limit)
+            write(report.getvalue(), path)
+    elif kind == "tracemalloc":
+        tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = ["current {} B, peak {} B".format(current, peak)]
+            lines += map(str, snapshot.statistics("lineno")[:limit])
+            write("\n".join(lines) + "\n", path)
+    else:
+        raise ValueError("unknown profile {}".format(kind))
+
+
+def write(report: str, path: Optional[str]):
+    if path is None:
+        sys.stderr.write(report)
+    else:
+        with open(path, "w") as f:
+            f.write(report)
@@ -1,24 +1,40 @@
 # author: Hendrik Werner s4549775
 # author: Constantin Blach s4329872
-from random import randint
-import socket
+from array import array
+from random import Random
+import struct
+import time
 
-import shutil
+from typing import Iterable, Optional
 
-from bTCP.exceptions import ChecksumMismatch
-from bTCP.message import BTCPMessage, MessageFactory
+from bTCP import checksum
+from bTCP.exceptions import InvalidFrame
+from bTCP.fastopen import make_cookie, valid_cookie
+from bTCP.message import MessageFactory
+from bTCP.header import unwrap
+from bTCP.options import Options
+from bTCP.pipeline import Writer
+from bTCP.session import SessionWriter
 from bTCP.state_machine import State, StateMachine
+from bTCP.transport import Transport
+from bTCP.window import ReceiveWindow
 
 
 class Server(StateMachine):
+    latency_samples = 1024
+
     def __init__(
         self,
-        sock: socket.socket,
+        sock: Transport,
         timeout: float,
         retry_limit: int,
         window_size: int,
         output_file: str,
+        fastopen_key: Optional[bytes]=None,
+        checksums: Iterable[int]=checksum.payload_checked,
+        write_behind: int=0,
     ):
+        super().__init__(sock)
         self.listen = Server.Listen(self)
         self.syn_received = Server.SynReceived(self)
         self.established = Server.Established(self)
@@ -27,124 +43,306 @@ class Server(StateMachine):
         self.finished = Server.Finished(self)
         self.state = self.listen
 
+        self.checksums = tuple(checksums)
         self.client_address = None
+        self.clock = time.perf_counter
+        # whether the whole upload was written and its output closed
+        self.complete = False
         self.expected_syn = 0
         self.factory = MessageFactory(0, window_size)
+        self.fastopen_key = fastopen_key
         self.output_file = output_file
-        self.sock = sock
+        self.random = Random()
+        self.receive_window = ReceiveWindow(window_size, timeout)
+        self.session = False
         self.stream_id = 0
+        self.syn_data = b""
+        self.syn_fin = False
         self.syn_number = 0
+        self.syn_cookies = None
+        self.synack_options = Options()
         self.timeout = timeout
-        self.window_size = window_size
+        self.write_behind = write_behind
+        # a uniform sample of the write latencies, of at most latency_samples
+        self.write_latencies = array("d")
+        self.writes = 0
+
+    def abort(self):
+        """Drop the connection, closing any partially written output."""
+        self.established.discard()
+        self.state = self.finished
+
+    def open_output(self, path: str):
+        return open(path, "wb")
+
+    def record_write(self, seconds: float):
+        self.writes += 1
+        if len(self.write_latencies) < Server.latency_samples:
+            self.write_latencies.append(seconds)
+        else:
+            # reservoir sampling keeps every write equally likely
+            index = self.random.randrange(self.writes)
+            if index < Server.latency_samples:
+                self.write_latencies[index] = seconds
+        self.receive_window.record_drain(1, seconds)
+
+    def write_latency(self, fraction: float) -> float:
+        """The given percentile of the time a write of one segment took,
+        estimated from the sampled writes."""
+        latencies = sorted(self.write_latencies)
+        if not latencies:
+            return 0.0
+        index = min(len(latencies) - 1, int(fraction * len(latencies)))
+        return latencies[index]
 
     class Listen(State):
-        def run(self):
+        def receive(self, syn_message, address, now):
             sm = self.state_machine
-            sm.sock.setblocking(True)
-            sm.syn_number = randint(0, 2 ** 8)
-            try:
-                data, sm.client_address = sm.sock.recvfrom(1016)
-                syn_message = BTCPMessage.from_bytes(data)
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.listen
             if not (
                 syn_message.header.syn and
                 syn_message.header.ack_number == 0
             ):
                 self.log_error("wrong message received")
                 return sm.listen
+            sm.client_address = address
+            if sm.syn_cookies is None:
+                sm.syn_number = sm.random.randint(0, 2 ** 8)
+            else:
+                sm.syn_number = sm.syn_cookies.make(
+                    address, syn_message.header, now
+                )
             sm.expected_syn = syn_message.header.syn_number + 1
             sm.stream_id = syn_message.header.id
             sm.factory.stream_id = syn_message.header.id
-            if (
+            sm.session = syn_message.header.session
+            sm.checksum = checksum.crc32
+            sm.syn_data = b""
+            sm.syn_fin = False
+            sm.synack_options = Options()
+            if syn_message.header.options:
+                try:
+                    options = Options.from_bytes(syn_message.payload)
+                    self.accept_options(options, address)
+                except InvalidFrame as e:
+                    self.log_error("invalid options received: {}".format(e))
+                    return sm.listen
+                if (
+                    syn_message.header.fin and
+                    Options.accepted in sm.synack_options and
+                    sm.syn_cookies is None
+                ):
+                    return self.finish()
+            elif (
                 syn_message.header.name and
                 0 < len(syn_message.payload) < 30
             ):
-                sm.output_file = str(syn_message.payload, "utf-8")
+                try:
+                    sm.output_file = self.decode_name(syn_message.payload)
+                except InvalidFrame as e:
+                    self.log_error("invalid name received: {}".format(e))
+                    return sm.listen
             return sm.syn_received
 
+        def decode_name(self, name: bytes) -> str:
+            try:
+                return str(name, "utf-8")
+            except UnicodeDecodeError:
+                raise InvalidFrame("file name is not UTF-8")
+
+        def finish(self):
+            """Store a whole input that arrived with the SYN."""
+            sm = self.state_machine
+            sm.syn_fin = True
+            try:
+                sm.established.close()
+                sm.complete = True
+            except (OSError, InvalidFrame) as e:
+                self.log_error("cannot write output: {}".format(e))
+            return sm.fin_received
+
+        def accept_options(self, options: Options, address):
+            sm = self.state_machine
+            name = options.get(Options.name, b"")
+            if 0 < len(name) < 30:
+                sm.output_file = self.decode_name(name)
+            if Options.checksum in options:
+                chosen = checksum.choose(
+                    options[Options.checksum], sm.checksums
+                )
+                if chosen is not None:
+                    sm.checksum = checksum.algorithms[chosen]
+                    sm.synack_options[Options.checksum] = bytes([chosen])
+            if sm.fastopen_key is None or Options.cookie not in options:
+                return
+            if valid_cookie(sm.fastopen_key, address, options[Options.cookie]):
+                sm.syn_data = options.get(Options.data, b"")
+                sm.synack_options[Options.accepted] = struct.pack(
+                    "!L", len(sm.syn_data)
+                )
+            else:
+                sm.synack_options[Options.cookie] = make_cookie(
+                    sm.fastopen_key, address
+                )
+
     class SynReceived(State):
-        def run(self):
+        def __init__(self, state_machine: StateMachine):
+            super().__init__(state_machine)
+            self.sent_at = 0.0
+
+        def enter(self, now):
             sm = self.state_machine
-            sm.sock.sendto(
-                sm.factory.synack_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
-                sm.client_address,
+            sm.factory.window_size = sm.receive_window.advertise(0)
+            options = sm.synack_options.to_bytes()
+            message = sm.factory.synack_message(
+                sm.syn_number, sm.expected_syn, options
             )
-            sm.sock.settimeout(sm.timeout)
-            try:
-                packet = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.syn_received
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.syn_received
+            message.header.options = bool(options)
+            sm.send(message, sm.client_address)
+            self.sent_at = now
+            return sm.syn_received
+
+        def deadline(self):
+            return self.sent_at + self.state_machine.timeout
+
+        def timer(self, now):
+            self.log_error("timed out")
+            return self.enter(now)
+
+        def receive(self, packet, address, now):
+            sm = self.state_machine
             if not (
                 packet.header.id == sm.stream_id and
-                packet.header.syn_number >= sm.expected_syn
+                unwrap(packet.header.syn_number, sm.expected_syn) >=
+                sm.expected_syn
             ):
                 self.log_error("wrong message received")
                 return sm.syn_received
             sm.syn_number += 1
             print("S Connection established")
-            return sm.established
+            return sm.established.receive(packet, address, now)
 
     class Established(State):
         def __init__(self, state_machine: StateMachine):
             super().__init__(state_machine)
-            self.output = bytes()
+            self.fin_at = None
+            self.output = None
+            self.poll_at = None
             self.window = {}
 
-        def run(self):
+        def receive(self, packet, address, now):
             sm = self.state_machine
-            try:
-                packet = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.established
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.established
-            if packet.header.id != sm.stream_id:
+            if (
+                packet.header.id != sm.stream_id or
+                packet.header.syn or
+                packet.header.ack
+            ):
                 return sm.established
-            if packet.header.no_flags:
+            try:
                 self.handle_data_packet(packet)
-                if shutil.disk_usage(".").free < len(self.output):
-                    return sm.fin_sent
-                sm.sock.sendto(
-                    sm.factory.ack_message(
-                        sm.syn_number, sm.expected_syn
-                    ).to_bytes(),
-                    sm.client_address,
-                )
-            elif (
-                packet.header.fin and
-                packet.header.syn_number == sm.expected_syn
-            ):
-                sm.expected_syn += 1
-                with open(sm.output_file, "wb") as f:
-                    f.write(self.output)
+            except (OSError, InvalidFrame) as e:
+                self.log_error("cannot write output: {}".format(e))
+                self.discard()
+                return sm.fin_sent
+            return self.acknowledge(now)
+
+        def deadline(self):
+            return self.poll_at
+
+        def timer(self, now):
+            sm = self.state_machine
+            expected_syn = sm.expected_syn
+            try:
+                self.deliver()
+            except (OSError, InvalidFrame) as e:
+                self.log_error("cannot write output: {}".format(e))
+                self.discard()
+                return sm.fin_sent
+            if sm.expected_syn == expected_syn:
+                self.poll_at = now + Writer.poll_interval
+                return sm.established
+            # tell the client that the window opened again
+            return self.acknowledge(now)
+
+        def acknowledge(self, now):
+            sm = self.state_machine
+            if self.fin_at is not None and sm.expected_syn > self.fin_at:
+                try:
+                    self.close()
+                    sm.complete = True
+                except (OSError, InvalidFrame) as e:
+                    self.log_error("cannot finish output: {}".format(e))
                 return sm.fin_received
+            self.poll_at = None
+            if sm.expected_syn in self.window:
+                # the writer is full, try again once it has room
+                self.poll_at = now + Writer.poll_interval
+            # segments still waiting for the writer occupy the window too
+            pending = 0 if self.output is None else self.output.pending
+            sm.factory.window_size = sm.receive_window.advertise(
+                len(self.window) + pending
+            )
+            sm.send(
+                sm.factory.ack_message(sm.syn_number, sm.expected_syn),
+                sm.client_address,
+            )
             return sm.established
 
         def handle_data_packet(self, packet):
             sm = self.state_machine
-            if packet.header.syn_number == sm.expected_syn:
-                self.output += packet.payload
-                sm.expected_syn += 1
-                while sm.expected_syn in self.window:
-                    self.output += self.window[sm.expected_syn]
-                    del self.window[sm.expected_syn]
-                    sm.expected_syn += 1
-            elif (
-                sm.expected_syn <
-                packet.header.syn_number <
-                sm.expected_syn + sm.window_size
+            syn_number = unwrap(packet.header.syn_number, sm.expected_syn)
+            if not (
+                sm.expected_syn <=
+                syn_number <
+                sm.expected_syn + sm.receive_window.capacity
             ):
-                self.window[packet.header.syn_number] = packet.payload
+                # a probe still lets waiting segments through
+                self.deliver()
+                return
+            if packet.header.fin:
+                self.fin_at = syn_number
+            self.window[syn_number] = packet.payload
+            self.deliver()
+
+        def deliver(self):
+            """Write the segments that are in order, as far as the writer
+            has room; the rest stays in the window until it has."""
+            sm = self.state_machine
+            while sm.expected_syn in self.window and not (
+                self.output is not None and self.output.full
+            ):
+                self.write(self.window.pop(sm.expected_syn))
+                sm.expected_syn += 1
+
+        def open(self):
+            sm = self.state_machine
+            if sm.session:
+                output = SessionWriter(sm.output_file)
+            else:
+                output = sm.open_output(sm.output_file)
+            self.output = Writer(
+                output, sm.record_write, sm.write_behind, sm.clock
+            )
+            # data accepted with the SYN precedes everything else
+            if sm.syn_data:
+                self.output.write(sm.syn_data)
+
+        def write(self, data: bytes):
+            if self.output is None:
+                self.open()
+            self.output.write(data)
+
+        def close(self):
+            if self.output is None:
+                self.open()
+            self.output.close()
+
+        def discard(self):
+            """Close the output after an error, stopping its writer."""
+            if self.output is not None:
+                try:
+                    self.output.close()
+                except (OSError, InvalidFrame):
+                    pass
 
     class FinSent(State):
         def __init__(
@@ -154,27 +352,30 @@ class Server(StateMachine):
         ):
             super().__init__(state_machine)
             self.retries = retry_limit
+            self.sent_at = 0.0
 
-        def run(self):
+        def enter(self, now):
             sm = self.state_machine
             if self.retries <= 0:
                 self.log_error("retry limit reached")
                 return sm.finished
             self.retries -= 1
-            sm.sock.sendto(
-                sm.factory.fin_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
+            sm.send(
+                sm.factory.fin_message(sm.syn_number, sm.expected_syn),
                 sm.client_address,
             )
-            try:
-                finack_message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.fin_sent
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.fin_sent
+            self.sent_at = now
+            return sm.fin_sent
+
+        def deadline(self):
+            return self.sent_at + self.state_machine.timeout
+
+        def timer(self, now):
+            self.log_error("timed out")
+            return self.enter(now)
+
+        def receive(self, finack_message, address, now):
+            sm = self.state_machine
             if not (
                 finack_message.header.fin and
                 finack_message.header.ack and
@@ -184,11 +385,9 @@ class Server(StateMachine):
                 return sm.fin_sent
             sm.syn_number += 1
             sm.expected_syn += 1
-            sm.sock.sendto(
-                sm.factory.ack_message(
-                    sm.syn_number, sm.expected_syn
-                ).to_bytes(),
-                sm.client_address
+            sm.send(
+                sm.factory.ack_message(sm.syn_number, sm.expected_syn),
+                sm.client_address,
             )
             return sm.finished
 
@@ -200,31 +399,51 @@ class Server(StateMachine):
         ):
             super().__init__(state_machine)
             self.retries = retry_limit
+            self.sent_at = 0.0
 
-        def run(self):
+        def enter(self, now):
             sm = self.state_machine
             if self.retries <= 0:
                 self.log_error("timeout limit reached.")
                 return sm.finished
             self.retries -= 1
-            sm.sock.sendto(
-                sm.factory.finack_message(
+            if sm.syn_fin:
+                # the SYN-ACK acknowledges the SYN and its FIN at once
+                options = sm.synack_options.to_bytes()
+                message = sm.factory.synack_message(
+                    sm.syn_number, sm.expected_syn, options
+                )
+                message.header.fin = True
+                message.header.options = True
+            else:
+                message = sm.factory.finack_message(
                     sm.syn_number, sm.expected_syn
-                ).to_bytes(),
-                sm.client_address,
-            )
-            try:
-                ack_message = BTCPMessage.from_bytes(sm.sock.recv(1016))
-            except socket.timeout:
-                self.log_error("timed out")
-                return sm.fin_received
-            except ChecksumMismatch:
-                self.log_error("checksum mismatch")
-                return sm.fin_received
+                )
+            sm.send(message, sm.client_address)
+            self.sent_at = now
+            return sm.fin_received
+
+        def deadline(self):
+            return self.sent_at + self.state_machine.timeout
+
+        def timer(self, now):
+            self.log_error("timed out")
+            return self.enter(now)
+
+        def receive(self, ack_message, address, now):
+            sm = self.state_machine
+            if (
+                ack_message.header.id == sm.stream_id and
+                ack_message.header.fin and
+                not ack_message.header.ack
+            ):
+                # our FIN-ACK was lost, the client repeats its FIN
+                return self.enter(now)
             if not (
                 ack_message.header.ack and
                 ack_message.header.id == sm.stream_id and
-                ack_message.header.syn_number == sm.expected_syn
+                unwrap(ack_message.header.syn_number, sm.expected_syn) ==
+                sm.expected_syn
             ):
                 self.log_error("wrong message received")
                 return sm.fin_received
@@ -0,0 +1,106 @@
+import os
+import struct
+
+from typing import Iterator, List, Tuple
+
+from bTCP.exceptions import InvalidFrame
+
+# every file in a session stream is preceded by its name length and size
+frame = struct.Struct("!HQ")
+
+
+def files(root: str) -> Iterator[Tuple[str, str]]:
+    """Yield (name relative to root, path) for every file below root."""
+    for directory, directories, file_names in os.walk(root):
+        directories.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            yield name, path
+
+
+def encode_files(root: str) -> bytes:
+    parts = []
+    for name, path in files(root):
+        with open(path, "rb") as f:
+            data = f.read()
+        encoded_name = name.encode("utf-8")
+        parts += [frame.pack(len(encoded_name), len(data)), encoded_name, data]
+    return b"".join(parts)
+
+
+class SessionWriter(object):
+    """Writes the files of a session stream below directory.
+
+    The stream may arrive in arbitrary chunks; every file is closed as soon
+    as its last byte has been written.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.completed = []  # type: List[str]
+        self.file = None
+        self.path = None
+        self.pending = bytearray()
+        self.remaining = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            if self.file is None:
+                view = self.read_frame(view)
+                continue
+            chunk = view[:self.remaining]
+            self.file.write(chunk)
+            self.remaining -= len(chunk)
+            view = view[len(chunk):]
+            if not self.remaining:
+                self.finish_file()
+
+    def read_frame(self, view: memoryview) -> memoryview:
+        view = self.take(view, frame.size)
+        if len(self.pending) < frame.size:
+            return view
+        name_length, self.remaining = frame.unpack_from(self.pending)
+        view = self.take(view, frame.size + name_length)
+        if len(self.pending) < frame.size + name_length:
+            return view
+        try:
+            name = str(self.pending[frame.size:], "utf-8")
+        except UnicodeDecodeError:
+            raise InvalidFrame("file name is not UTF-8")
+        self.pending = bytearray()
+        self.open(name)
+        if not self.remaining:
+            self.finish_file()
+        return view
+
+    def take(self, view: memoryview, length: int) -> memoryview:
+        needed = max(0, length - len(self.pending))
+        self.pending += view[:needed]
+        return view[needed:]
+
+    def open(self, name: str):
+        relative = os.path.normpath(name)
+        if (
+            not name or
+            os.path.isabs(relative) or
+            relative.split(os.sep)[0] == os.pardir
+        ):
+            raise InvalidFrame("invalid file name {!r}".format(name))
+        self.path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "wb")
+
+    def finish_file(self):
+        self.file.close()
+        self.file = None
+        self.completed.append(self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            raise InvalidFrame("stream ended inside {}".format(self.path))
+        if self.pending:
+            raise InvalidFrame("stream ended inside a frame header")
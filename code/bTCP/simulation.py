@@ -0,0 +1,180 @@
+import heapq
+import random
+
+from typing import List, Optional, Tuple
+
+from bTCP.client import Client
+from bTCP.impairment import Impairment, Link
+from bTCP.server import Server
+
+
+class SyntheticInput(object):
+    """Reproducible input of any size, without holding it in memory.
+
+    Supports the len and slicing that the Client needs from input bytes.
+    """
+    block_size = 2 ** 16
+
+    def __init__(self, size: int, seed: int=0):
+        block = random.Random(seed).getrandbits(
+            SyntheticInput.block_size * 8
+        ).to_bytes(SyntheticInput.block_size, "little")
+        self.size = size
+        # slices up to a block long never have to wrap around
+        self.blocks = block + block
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: slice) -> bytes:
+        start, stop, _ = index.indices(self.size)
+        parts = []
+        while start < stop:
+            offset = start % SyntheticInput.block_size
+            length = min(stop - start, SyntheticInput.block_size)
+            parts.append(self.blocks[offset:offset + length])
+            start += length
+        return b"".join(parts)
+
+
+class Verifier(object):
+    """An output file that compares everything written to the input."""
+
+    def __init__(self, expected: SyntheticInput):
+        self.expected = expected
+        self.size = 0
+        self.correct = True
+
+    def write(self, data: bytes):
+        if self.expected[self.size:self.size + len(data)] != data:
+            self.correct = False
+        self.size += len(data)
+
+    def close(self):
+        if self.size != len(self.expected):
+            self.correct = False
+
+
+class SimulatedServer(Server):
+    def __init__(self, simulation: "Simulation", *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.simulation = simulation
+        self.clock = lambda: simulation.now
+        self.verifier = None
+
+    def open_output(self, path: str):
+        self.verifier = Verifier(self.simulation.input)
+        return self.verifier
+
+
+class Simulation(object):
+    """Runs a transfer between a Client and a Server on a virtual clock.
+
+    Datagrams travel over an upstream and a downstream Link; nothing waits
+    for real time, and the same seed always gives the same result.
+    """
+    client_address = ("10.0.0.1", 1)
+    server_address = ("10.0.0.2", 2)
+
+    def __init__(
+        self,
+        size: int,
+        upstream: Impairment,
+        downstream: Impairment=None,
+        window: int=100,
+        timeout: float=0.1,
+        retry_limit: int=100,
+        seed: int=0,
+    ):
+        self.input = SyntheticInput(size, seed)
+        self.now = 0.0
+        self.events = []  # type: List[Tuple[float, int, bytes, bool]]
+        self.sequence = 0
+        self.upstream = Link(upstream, seed)
+        self.downstream = Link(downstream or upstream, seed + 1)
+        self.client = Client(
+            None, self.input, self.server_address, window, timeout,
+            retry_limit, "",
+        )
+        self.client.random = random.Random(seed)
+        self.server = SimulatedServer(
+            self, timeout, retry_limit, window, "simulated",
+        )
+        self.server.random = random.Random(seed + 1)
+        self.completed_at = None  # type: Optional[float]
+        self.delivered = 0
+
+    def transmit(self):
+        for sender, link, to_server in (
+            (self.client, self.upstream, True),
+            (self.server, self.downstream, False),
+        ):
+            for data, _ in sender.datagrams_to_send():
+                for delivery, datagram in link.schedule(data, self.now):
+                    heapq.heappush(self.events, (
+                        delivery, self.sequence, datagram, to_server,
+                    ))
+                    self.sequence += 1
+
+    def next_time(self) -> Optional[float]:
+        times = [
+            time for time in (
+                self.client.next_deadline(), self.server.next_deadline(),
+            )
+            if time is not None
+        ]
+        if self.events:
+            times.append(self.events[0][0])
+        return min(times) if times else None
+
+    def run(self, limit: float=3600.0) -> dict:
+        client = self.client
+        server = self.server
+        while not (
+            client.state is client.finished and
+            server.state is server.finished
+        ):
+            now = self.next_time()
+            if now is None or now > limit:
+                break
+            self.now = max(self.now, now)
+            if self.events and self.events[0][0] <= self.now:
+                _, _, datagram, to_server = heapq.heappop(self.events)
+                self.delivered += 1
+                if to_server:
+                    server.receive_datagram(
+                        datagram, self.now, self.client_address
+                    )
+                else:
+                    client.receive_datagram(
+                        datagram, self.now, self.server_address
+                    )
+            client.handle_timer(self.now)
+            server.handle_timer(self.now)
+            if self.completed_at is None and client.state in (
+                client.time_wait, client.finished
+            ):
+                self.completed_at = self.now
+            self.transmit()
+        return self.results()
+
+    def results(self) -> dict:
+        client = self.client
+        verifier = self.server.verifier
+        duration = self.completed_at
+        return {
+            "bytes": len(self.input),
+            "completed": duration is not None,
+            "correct": (
+                verifier is not None and verifier.correct and
+                verifier.size == len(self.input)
+            ),
+            "virtual_seconds": duration,
+            "goodput": len(self.input) / duration if duration else 0.0,
+            "segments_sent": client.segments_sent,
+            "retransmissions": client.retransmissions,
+            "retransmission_ratio": (
+                client.retransmissions / max(1, client.segments_sent)
+            ),
+            "datagrams_delivered": self.delivered,
+        }
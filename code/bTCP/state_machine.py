@@ -1,6 +1,15 @@
 # author: Hendrik Werner s4549775
 # author: Constantin Blach s4329872
+import socket
 import sys
+import time
+
+from typing import List, Optional, Tuple
+
+from bTCP import checksum
+from bTCP.exceptions import ChecksumMismatch
+from bTCP.message import BTCPMessage
+from bTCP.transport import Address, Transport
 
 
 class State(object):
@@ -10,8 +19,22 @@ class State(object):
     ):
         self.state_machine = state_machine
 
-    def run(self):
-        raise NotImplementedError
+    def enter(self, now: float) -> "State":
+        return self
+
+    def receive(
+        self,
+        message: BTCPMessage,
+        address: Address,
+        now: float,
+    ) -> "State":
+        return self
+
+    def timer(self, now: float) -> "State":
+        return self
+
+    def deadline(self) -> Optional[float]:
+        return None
 
     def log_error(
         self,
@@ -26,5 +49,83 @@ class State(object):
 
 
 class StateMachine(object):
+    """The protocol core, free of any I/O.
+
+    Incoming datagrams are passed to receive_datagram and expired timers to
+    handle_timer, the caller sends whatever datagrams_to_send returns and
+    calls handle_timer again at next_deadline. run drives all of this with
+    the blocking transport in sock.
+
+    Setting accounting to a bTCP.accounting.StateAccounting records where
+    the state machine spends its time.
+    """
+
+    def __init__(self, sock: Transport=None):
+        self.accounting = None
+        self.checksum = checksum.crc32
+        self.outbox = []
+        self.sock = sock
+
+    def send(self, message: BTCPMessage, address: Address):
+        self.outbox.append((message.to_bytes(self.checksum), address))
+
+    def send_datagram(self, data: bytes, address: Address):
+        """Send a message that was already encoded."""
+        self.outbox.append((data, address))
+
+    def transition(self, state: State, now: float):
+        while state is not self.state:
+            if self.accounting is not None:
+                self.accounting.transition(self.state, state)
+            self.state = state
+            state = state.enter(now)
+
+    def receive_datagram(
+        self,
+        data: bytes,
+        now: float,
+        address: Address=None,
+    ):
+        if self.accounting is not None:
+            self.accounting.iteration(self.state)
+        try:
+            message = BTCPMessage.from_bytes(data, self.checksum)
+        except ChecksumMismatch:
+            self.state.log_error("checksum mismatch")
+            return
+        self.transition(self.state.receive(message, address, now), now)
+
+    def handle_timer(self, now: float):
+        deadline = self.state.deadline()
+        if deadline is not None and deadline <= now:
+            if self.accounting is not None:
+                self.accounting.iteration(self.state)
+            self.transition(self.state.timer(now), now)
+
+    def datagrams_to_send(self) -> List[Tuple[bytes, Address]]:
+        outbox = self.outbox
+        self.outbox = []
+        return outbox
+
+    def next_deadline(self) -> Optional[float]:
+        return self.state.deadline()
+
+    def flush(self):
+        for data, address in self.datagrams_to_send():
+            self.sock.sendto(data, address)
+
     def run(self):
-        self.state = self.state.run()
+        now = time.monotonic()
+        deadline = self.next_deadline()
+        if deadline is not None and deadline <= now:
+            self.handle_timer(now)
+        else:
+            self.flush()
+            self.sock.settimeout(None if deadline is None else deadline - now)
+            try:
+                data, address = self.sock.recvfrom(1016)
+            except socket.timeout:
+                pass
+            else:
+                self.receive_datagram(data, time.monotonic(), address)
+        self.flush()
@@ -1,10 +1,38 @@
 # author: Hendrik Werner s4549775
+import asyncio
+import contextlib
+import io
+import os
+import queue
+import random
+import resource
+import socket
 import struct
+import tempfile
+import threading
+import time
 import unittest
 
-from bTCP.exceptions import ChecksumMismatch
-from bTCP.message import BTCPMessage
-from bTCP.header import BTCPHeader
+from bTCP import aio, checksum
+from bTCP.accounting import StateAccounting
+from bTCP.capture import Capture, read_capture, timelines
+from bTCP.client import Client
+from bTCP.exceptions import ChecksumMismatch, InvalidFrame
+from bTCP.message import BTCPMessage, MessageFactory
+from bTCP.header import BTCPHeader, sequence_space, unwrap
+from bTCP.fastopen import make_cookie
+from bTCP.impairment import (
+    BernoulliLoss, GilbertElliottLoss, Impairment, ImpairmentProxy, Link,
+    profiles,
+)
+from bTCP.listener import Listener
+from bTCP.options import Options
+from bTCP.pipeline import ReadAhead, Writer
+from bTCP.server import Server
+from bTCP.session import SessionWriter, encode_files
+from bTCP.simulation import Simulation
+from bTCP.transport import LoopbackNetwork
+from bTCP.window import ReceiveWindow
 
 
 class BTCPHeaderTest(unittest.TestCase):
@@ -22,6 +50,18 @@ class BTCPHeaderTest(unittest.TestCase):
             BTCPHeader(1, 2, 3, 4, 5, 6)
         )
 
+    def test_wrap(self):
+        header = BTCPHeader(1, sequence_space + 2, 3, 4, 5, 6)
+        self.assertEqual(
+            BTCPHeader.from_bytes(header.to_bytes()).syn_number, 2
+        )
+        self.assertEqual(unwrap(2, sequence_space - 3), sequence_space + 2)
+        self.assertEqual(
+            unwrap(sequence_space - 3, sequence_space + 2),
+            sequence_space - 3
+        )
+        self.assertEqual(unwrap(5, 3), 5)
+
     def test_flags(self):
         header = BTCPHeader(0, 0, 0, 0, 0)
         self.assertTrue(header.no_flags)
@@ -37,10 +77,14 @@ class BTCPHeaderTest(unittest.TestCase):
         header.name = True
         self.assertEqual(header._flags, 15)
         self.assertFalse(header.no_flags)
+        header.session = True
+        self.assertEqual(header._flags, 31)
+        self.assertFalse(header.no_flags)
         header.syn = False
         header.ack = False
         header.fin = False
         header.name = False
+        header.session = False
         self.assertEqual(header._flags, 0)
         self.assertTrue(header.no_flags)
 
@@ -97,10 +141,902 @@ class BTCPMessageTest(unittest.TestCase):
             BTCPMessage.from_bytes, message_bad_payload
         )
 
+    def test_checksum_algorithms(self):
+        message = BTCPMessage(BTCPHeader(1, 2, 3, 0, 5), b"payload")
+        for algorithm in checksum.algorithms.values():
+            self.assertEqual(
+                message,
+                BTCPMessage.from_bytes(message.to_bytes(algorithm), algorithm)
+            )
+        self.assertRaises(
+            ChecksumMismatch,
+            BTCPMessage.from_bytes,
+            message.to_bytes(checksum.adler32), checksum.crc32
+        )
+        data = message.to_bytes(checksum.header_only)
+        altered = data[:16] + b"PAYLOAD" + data[23:]
+        self.assertEqual(
+            BTCPMessage.from_bytes(altered, checksum.header_only).payload,
+            b"PAYLOAD"
+        )
+
+    def test_syn_checksum(self):
+        message = BTCPMessage(BTCPHeader(1, 2, 3, 0, 5), b"payload")
+        message.header.syn = True
+        self.assertEqual(
+            message.to_bytes(checksum.adler32), message.to_bytes()
+        )
+
     def test_data_length(self):
         message = BTCPMessage(BTCPHeader(1, 2, 3, 4, 5), b"payload")
         self.assertEqual(message.header.data_length, len(b"payload"))
 
 
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        capture = Capture(self.path, capacity=2)
+        data = BTCPMessage(BTCPHeader(1, 2, 3, 0, 5), b"payload").to_bytes()
+        capture.record(Capture.sent, data)
+        capture.record(Capture.received, b"garbage")
+        capture.record(Capture.sent, data)
+        capture.flush()
+        records = list(read_capture(self.path))
+        self.assertEqual(
+            [(r.direction, r.data) for r in records],
+            [
+                (Capture.sent, data),
+                (Capture.received, b"garbage"),
+                (Capture.sent, data),
+            ]
+        )
+
+    def test_timelines(self):
+        capture = Capture(self.path)
+        data = BTCPMessage(BTCPHeader(1, 2, 3, 0, 5), b"payload").to_bytes()
+        ack = BTCPMessage(BTCPHeader(1, 7, 3, 2, 5), b"").to_bytes()
+        for direction, datagram in (
+            (Capture.sent, data),
+            (Capture.received, ack),
+            (Capture.received, ack),
+            (Capture.sent, data),
+        ):
+            capture.record(direction, datagram)
+        capture.flush()
+        connections = timelines(read_capture(self.path))
+        self.assertEqual(list(connections), [1])
+        self.assertEqual(
+            [event.retransmission for event in connections[1]],
+            [False, False, False, True]
+        )
+
+    def test_timelines_wrap(self):
+        capture = Capture(self.path)
+        count = sequence_space + 10
+        for syn_number in range(count):
+            capture.record(Capture.sent, BTCPMessage(
+                BTCPHeader(1, syn_number, 0, 0, 5), b""
+            ).to_bytes())
+        capture.record(Capture.sent, BTCPMessage(
+            BTCPHeader(1, sequence_space + 3, 0, 0, 5), b""
+        ).to_bytes())
+        capture.flush()
+        events = timelines(read_capture(self.path))[1]
+        self.assertEqual(len(events), count + 1)
+        self.assertEqual(
+            sum(event.retransmission for event in events), 1
+        )
+        self.assertTrue(events[-1].retransmission)
+
+
+class ImpairmentTest(unittest.TestCase):
+    def schedule(self, impairment, seed=0):
+        link = Link(impairment, seed)
+        return [
+            link.schedule(bytes([i]) * 100, float(i)) for i in range(200)
+        ]
+
+    def test_reproducible(self):
+        impairment = profiles()["allbad"]
+        self.assertEqual(
+            self.schedule(impairment), self.schedule(impairment)
+        )
+        self.assertNotEqual(
+            self.schedule(impairment), self.schedule(impairment, seed=1)
+        )
+
+    def test_ideal(self):
+        self.assertEqual(
+            self.schedule(Impairment()),
+            [[(float(i), bytes([i]) * 100)] for i in range(200)]
+        )
+
+    def test_gilbert_elliott_bursts(self):
+        deliveries = self.schedule(
+            Impairment(loss=GilbertElliottLoss(0.05, 0.2))
+        )
+        lost = [not delivered for delivered in deliveries]
+        self.assertTrue(any(lost))
+        self.assertTrue(any(
+            lost[i] and lost[i + 1] for i in range(len(lost) - 1)
+        ))
+
+    def test_rate(self):
+        link = Link(Impairment(rate=1000), 0)
+        self.assertEqual(link.schedule(b"x" * 100, 0.0), [(0.1, b"x" * 100)])
+        self.assertEqual(link.schedule(b"x" * 100, 0.0), [(0.2, b"x" * 100)])
+
+    def test_proxy_clients(self):
+        self.relay(2)
+
+    @unittest.skipIf(
+        resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1400,
+        "too few file descriptors",
+    )
+    def test_proxy_many_clients(self):
+        # a socket per client and one upstream for each pass FD_SETSIZE
+        self.relay(600)
+
+    def relay(self, count):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        proxy = ImpairmentProxy(server.getsockname())
+        proxy.start()
+        clients = [
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for _ in range(count)
+        ]
+        try:
+            for i, client in enumerate(clients):
+                client.settimeout(5)
+                client.sendto(i.to_bytes(2, "big"), proxy.address)
+                data, address = server.recvfrom(16)
+                server.sendto(data * 2, address)
+            for i, client in enumerate(clients):
+                self.assertEqual(
+                    client.recvfrom(16)[0], i.to_bytes(2, "big") * 2
+                )
+        finally:
+            proxy.stop()
+            server.close()
+            for client in clients:
+                client.close()
+
+
+def run_until_finished(state_machine):
+    while state_machine.state is not state_machine.finished:
+        state_machine.run()
+
+
+class LoopbackTest(unittest.TestCase):
+    def test_timeout(self):
+        transport, _ = LoopbackNetwork().pair()
+        transport.settimeout(0.001)
+        self.assertRaises(socket.timeout, transport.recv, 1016)
+        transport.setblocking(False)
+        self.assertRaises(BlockingIOError, transport.recv, 1016)
+
+    def test_transfer(self):
+        client_transport, server_transport = LoopbackNetwork().pair()
+        data = os.urandom(50 * BTCPMessage.payload_size + 7)
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            server = Server(server_transport, 0.01, 10, 100, output_file)
+            client = Client(
+                client_transport, data, server_transport.address, 100, 0.01,
+                10, "",
+            )
+            thread = threading.Thread(
+                target=run_until_finished, args=(server,)
+            )
+            thread.start()
+            run_until_finished(client)
+            thread.join()
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+
+class SansIOTest(unittest.TestCase):
+    client_address = ("127.0.0.1", 1)
+    server_address = ("127.0.0.1", 2)
+
+    def test_handshake(self):
+        client = Client(None, b"data", self.server_address, 100, 1, 10, "")
+        server = Server(None, 1, 10, 100, "out.file")
+        self.assertEqual(client.next_deadline(), 0.0)
+        self.assertEqual(server.next_deadline(), None)
+        client.handle_timer(0.0)
+        [(syn, address)] = client.datagrams_to_send()
+        self.assertEqual(address, self.server_address)
+        self.assertTrue(BTCPMessage.from_bytes(syn).header.syn)
+        self.assertEqual(client.next_deadline(), 1.0)
+        client.handle_timer(0.5)
+        self.assertEqual(client.datagrams_to_send(), [])
+        client.handle_timer(1.0)
+        self.assertEqual(client.datagrams_to_send(), [(syn, address)])
+
+        server.receive_datagram(syn, 1.0, self.client_address)
+        [(synack, address)] = server.datagrams_to_send()
+        self.assertEqual(address, self.client_address)
+        client.receive_datagram(synack, 1.1, self.server_address)
+        ack, data = [
+            BTCPMessage.from_bytes(datagram)
+            for datagram, _ in client.datagrams_to_send()
+        ]
+        self.assertTrue(ack.header.ack)
+        self.assertEqual(data.payload, b"data")
+        self.assertIs(client.state, client.established)
+        self.assertEqual(client.next_deadline(), 2.1)
+
+    def test_zero_window_probe(self):
+        client = Client(None, b"data", self.server_address, 100, 1, 10, "")
+        server = Server(None, 1, 10, 100, "out.file")
+        server.receive_window.capacity = 0
+        client.handle_timer(0.0)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        for datagram, _ in server.datagrams_to_send():
+            client.receive_datagram(datagram, 0.0, self.server_address)
+        [(ack, _)] = client.datagrams_to_send()
+        self.assertTrue(BTCPMessage.from_bytes(ack).header.ack)
+        self.assertEqual(client.next_deadline(), 1.0)
+        client.handle_timer(1.0)
+        [(probe, _)] = client.datagrams_to_send()
+        self.assertEqual(BTCPMessage.from_bytes(probe).payload, b"data")
+        self.assertEqual(client.next_deadline(), 2.0)
+
+    def test_fin_retry_limit(self):
+        client = Client(None, b"data", self.server_address, 100, 1, 3, "")
+        server = Server(None, 1, 10, 100, "out.file")
+        client.handle_timer(0.0)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        for datagram, _ in server.datagrams_to_send():
+            client.receive_datagram(datagram, 0.0, self.server_address)
+        client.datagrams_to_send()
+        client.handle_timer(1.0)
+        client.handle_timer(2.0)
+        self.assertEqual(client.established.retries, 1)
+        # an acknowledgement without progress shows the server is alive
+        server.factory.window_size = 0
+        client.receive_datagram(
+            server.factory.ack_message(
+                server.syn_number, client.highest_ack
+            ).to_bytes(),
+            2.0, self.server_address,
+        )
+        self.assertEqual(client.established.retries, 3)
+        # the server is gone, so the FIN is never acknowledged
+        client.datagrams_to_send()
+        now = 0.0
+        while client.state is client.established:
+            now = client.next_deadline()
+            client.handle_timer(now)
+        self.assertIs(client.state, client.finished)
+        self.assertEqual(client.retransmissions, 5)
+        self.assertEqual(now, 6.0)
+
+    def exchange(self, client, server):
+        now = 0.0
+        while not (
+            client.state is client.finished and
+            server.state is server.finished
+        ):
+            for state_machine in (client, server):
+                state_machine.handle_timer(now)
+            for datagram, _ in client.datagrams_to_send():
+                server.receive_datagram(datagram, now, self.client_address)
+            for datagram, _ in server.datagrams_to_send():
+                client.receive_datagram(datagram, now, self.server_address)
+            now += 0.1
+
+    def test_transfer(self):
+        data = os.urandom(20 * BTCPMessage.payload_size)
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            client = Client(None, data, self.server_address, 100, 1, 10, "")
+            server = Server(None, 1, 10, 10, output_file)
+            self.exchange(client, server)
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_accounting(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            client = Client(None, b"data", self.server_address, 100, 1, 10, "")
+            server = Server(None, 1, 10, 10, output_file)
+            server.accounting = StateAccounting(server.state)
+            self.exchange(client, server)
+            report = server.accounting.report()
+        self.assertEqual(report["transitions"], {
+            "Listen -> SynReceived": 1,
+            "SynReceived -> Established": 1,
+            "Established -> FinReceived": 1,
+            "FinReceived -> Finished": 1,
+        })
+        self.assertEqual(report["states"]["Listen"]["iterations"], 1)
+        self.assertEqual(report["states"]["Established"]["iterations"], 1)
+        for row in report["states"].values():
+            self.assertGreaterEqual(row["wall_seconds"], 0)
+
+    def test_checksum_negotiation(self):
+        data = os.urandom(5 * BTCPMessage.payload_size)
+        for accepted, expected in (
+            ((1, 2), checksum.adler32),
+            ((1,), checksum.crc32),
+        ):
+            with tempfile.TemporaryDirectory() as directory:
+                output_file = os.path.join(directory, "out.file")
+                client = Client(
+                    None, data, self.server_address, 100, 1, 10, "",
+                    checksums=(checksum.names["adler32"],),
+                )
+                server = Server(
+                    None, 1, 10, 10, output_file, checksums=accepted,
+                )
+                self.exchange(client, server)
+                self.assertIs(client.checksum, expected)
+                self.assertIs(server.checksum, expected)
+                with open(output_file, "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_read_ahead(self):
+        for data in (b"", os.urandom(20 * BTCPMessage.payload_size + 1)):
+            with tempfile.TemporaryDirectory() as directory:
+                output_file = os.path.join(directory, "out.file")
+                read_ahead = ReadAhead(io.BytesIO(data), depth=4)
+                client = Client(
+                    None, b"", self.server_address, 100, 1, 10, "",
+                    read_ahead=read_ahead,
+                )
+                server = Server(None, 1, 10, 10, output_file)
+                try:
+                    self.exchange(client, server)
+                finally:
+                    read_ahead.close()
+                with open(output_file, "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_slow_read_ahead(self):
+        class SlowFile(io.BytesIO):
+            def __init__(self, data):
+                super().__init__(data)
+                self.ready = threading.Event()
+
+            def read(self, size=-1):
+                self.ready.wait()
+                return super().read(size)
+
+        data = os.urandom(3 * BTCPMessage.payload_size)
+        source = SlowFile(data)
+        read_ahead = ReadAhead(source)
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            client = Client(
+                None, b"", self.server_address, 100, 1, 10, "",
+                read_ahead=read_ahead,
+            )
+            server = Server(None, 1, 10, 10, output_file)
+            client.handle_timer(0.0)
+            for datagram, _ in client.datagrams_to_send():
+                server.receive_datagram(datagram, 0.0, self.client_address)
+            for datagram, _ in server.datagrams_to_send():
+                client.receive_datagram(datagram, 0.0, self.server_address)
+            # nothing is read yet, but the client still answers at once
+            self.assertIs(client.state, client.established)
+            self.assertEqual(client.segments_sent, 0)
+            self.assertEqual(client.next_deadline(), ReadAhead.poll_interval)
+            source.ready.set()
+            try:
+                self.exchange(client, server)
+            finally:
+                read_ahead.close()
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_write_behind(self):
+        data = os.urandom(10 * BTCPMessage.payload_size)
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            client = Client(None, data, self.server_address, 100, 1, 10, "")
+            server = Server(None, 1, 10, 10, output_file, write_behind=8)
+            self.exchange(client, server)
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(len(server.write_latencies), 10)
+        self.assertLessEqual(
+            server.write_latency(0.5), server.write_latency(1.0)
+        )
+        for _ in range(2 * Server.latency_samples):
+            server.record_write(1.0)
+        self.assertEqual(server.writes, 10 + 2 * Server.latency_samples)
+        self.assertEqual(
+            len(server.write_latencies), Server.latency_samples
+        )
+
+    def test_slow_writer(self):
+        sink = WriterTest.Sink()
+
+        class SlowServer(Server):
+            def open_output(self, path):
+                return sink
+
+        data = os.urandom(10 * BTCPMessage.payload_size)
+        client = Client(None, data, self.server_address, 100, 1, 10, "")
+        server = SlowServer(None, 1, 10, 10, "out.file", write_behind=2)
+        client.handle_timer(0.0)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        for datagram, _ in server.datagrams_to_send():
+            client.receive_datagram(datagram, 0.0, self.server_address)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        acks = [
+            BTCPMessage.from_bytes(datagram).header
+            for datagram, _ in server.datagrams_to_send()
+        ]
+        # the writer is stuck, so the window closes instead of blocking
+        self.assertEqual(acks[-1].window_size, 0)
+        self.assertLessEqual(acks[-1].ack_number - acks[0].ack_number, 3)
+        sink.unblocked.set()
+        self.exchange(client, server)
+        self.assertEqual(sink.contents, data)
+
+    def test_write_error(self):
+        class FailingSink(io.BytesIO):
+            def write(self, data):
+                raise OSError("disk full")
+
+        class FailingServer(Server):
+            def open_output(self, path):
+                return FailingSink()
+
+        data = os.urandom(10 * BTCPMessage.payload_size)
+        client = Client(None, data, self.server_address, 100, 1, 10, "")
+        server = FailingServer(None, 1, 10, 10, "out.file", write_behind=4)
+        client.handle_timer(0.0)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        for datagram, _ in server.datagrams_to_send():
+            client.receive_datagram(datagram, 0.0, self.server_address)
+        ack, first, *rest = client.datagrams_to_send()
+        for datagram, _ in (ack, first):
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        writer = server.established.output
+        while writer.error is None:
+            time.sleep(0.001)
+        for datagram, _ in rest:
+            server.receive_datagram(datagram, 0.0, self.client_address)
+        self.assertIs(server.state, server.fin_sent)
+        # the writer thread is stopped and the output closed
+        self.assertFalse(writer.thread)
+        self.assertTrue(writer.output.closed)
+
+    def test_session(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source")
+            os.makedirs(os.path.join(source, "sub"))
+            contents = {
+                "a": os.urandom(2500),
+                "empty": b"",
+                os.path.join("sub", "b"): os.urandom(10),
+            }
+            for name, data in contents.items():
+                with open(os.path.join(source, name), "wb") as f:
+                    f.write(data)
+            output = os.path.join(directory, "output")
+            client = Client(
+                None, encode_files(source), self.server_address, 100, 1, 10,
+                "", session=True,
+            )
+            server = Server(None, 1, 10, 10, output)
+            self.exchange(client, server)
+            for name, data in contents.items():
+                with open(os.path.join(output, name), "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_fastopen(self):
+        key = b"key"
+        data = os.urandom(500)
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "out.file")
+            client = Client(
+                None, data, self.server_address, 100, 1, 10, "",
+                fastopen=True,
+            )
+            server = Server(None, 1, 10, 10, output_file, fastopen_key=key)
+            self.exchange(client, server)
+            cookie = make_cookie(key, self.client_address)
+            self.assertEqual(client.fastopen_cookie, cookie)
+
+            client = Client(
+                None, data, self.server_address, 100, 1, 10, "",
+                fastopen=True, fastopen_cookie=cookie,
+            )
+            server = Server(None, 1, 10, 10, output_file, fastopen_key=key)
+            flights = self.flights(client, server)
+            # the whole exchange takes one round trip
+            self.assertEqual(len(flights), 1)
+            [syn] = flights[0]
+            self.assertEqual(
+                Options.from_bytes(syn.payload)[Options.data], data
+            )
+            self.assertTrue(syn.header.fin)
+            self.assertEqual(client.segments_sent, 0)
+            self.assertIs(server.state, server.finished)
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # more than fits in the SYN takes another round trip
+            data = os.urandom(1500)
+            client = Client(
+                None, data, self.server_address, 100, 1, 10, "",
+                fastopen=True, fastopen_cookie=cookie,
+            )
+            server = Server(None, 1, 10, 10, output_file, fastopen_key=key)
+            self.assertEqual(len(self.flights(client, server)), 2)
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def flights(self, client, server) -> list:
+        """Exchange datagrams until the client has sent everything, and
+        return the messages it sent before each wait for the server."""
+        now = 0.0
+        client.handle_timer(now)
+        flights = []
+        while client.state not in (client.time_wait, client.finished):
+            flights.append([])
+            for datagram, _ in client.datagrams_to_send():
+                flights[-1].append(BTCPMessage.from_bytes(datagram))
+                server.receive_datagram(datagram, now, self.client_address)
+            for datagram, _ in server.datagrams_to_send():
+                client.receive_datagram(datagram, now, self.server_address)
+        for datagram, _ in client.datagrams_to_send():
+            server.receive_datagram(datagram, now, self.client_address)
+        return flights
+
+
+class ListenerTest(unittest.TestCase):
+    server_address = ("127.0.0.1", 2)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.closed = []
+        self.listener = Listener(
+            None, self.make_server, max_connections=2, idle_timeout=5,
+            on_close=lambda address, server: self.closed.append(address),
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_server(self):
+        return Server(
+            None, 1, 10, 10, os.path.join(self.directory.name, "out.file"),
+        )
+
+    def handshake(self, client, address, now=0.0):
+        client.handle_timer(now)
+        [(syn, _)] = client.datagrams_to_send()
+        self.listener.receive_datagram(syn, now, address)
+        [(synack, _)] = self.listener.datagrams_to_send()
+        return synack
+
+    def test_stateless_handshake(self):
+        address = ("127.0.0.1", 1)
+        client = Client(None, b"data", self.server_address, 100, 1, 10, "")
+        synack = self.handshake(client, address)
+        self.assertEqual(self.listener.connections, {})
+        client.receive_datagram(synack, 0.0, self.server_address)
+        ack, data = [datagram for datagram, _ in client.datagrams_to_send()]
+        self.listener.receive_datagram(ack, 0.0, ("127.0.0.1", 3))
+        self.assertEqual(self.listener.connections, {})
+        self.listener.receive_datagram(ack, 0.0, address)
+        self.assertEqual(list(self.listener.connections), [address])
+        self.listener.receive_datagram(data, 0.0, address)
+        now = 0.0
+        while client.state is not client.finished:
+            self.listener.handle_timer(now)
+            client.handle_timer(now)
+            for datagram, _ in self.listener.datagrams_to_send():
+                client.receive_datagram(datagram, now, self.server_address)
+            for datagram, _ in client.datagrams_to_send():
+                self.listener.receive_datagram(datagram, now, address)
+            now += 0.1
+        self.assertEqual(self.listener.connections, {})
+        self.assertEqual(self.closed, [address])
+        with open(os.path.join(self.directory.name, "out.file"), "rb") as f:
+            self.assertEqual(f.read(), b"data")
+        # a late copy of the handshake ACK does not open it again
+        self.listener.receive_datagram(ack, now, address)
+        self.assertEqual(self.listener.connections, {})
+        # and is forgotten once the cookie expired
+        self.listener.forget(now + 2 * self.listener.cookies.lifetime)
+        self.assertEqual(self.listener.closed, {})
+
+    def test_invalid_name(self):
+        address = ("127.0.0.1", 1)
+        factory = MessageFactory(1, 100)
+        syn = factory.syn_message(5, 0, b"\xff\xfe")
+        options = Options()
+        options[Options.name] = b"\xff\xfe"
+        options_syn = factory.syn_message(5, 0, options.to_bytes())
+        options_syn.header.name = False
+        options_syn.header.options = True
+        for message in (syn, options_syn):
+            self.listener.receive_datagram(message.to_bytes(), 0.0, address)
+            # the SYN is dropped without an answer
+            self.assertEqual(self.listener.datagrams_to_send(), [])
+        client = Client(None, b"data", self.server_address, 100, 1, 10, "")
+        self.handshake(client, address)
+
+    def test_eviction(self):
+        addresses = [("127.0.0.1", port) for port in range(10, 13)]
+        for now, address in enumerate(addresses):
+            client = Client(None, b"", self.server_address, 100, 1, 10, "")
+            synack = self.handshake(client, address, now)
+            client.receive_datagram(synack, now, self.server_address)
+            ack = client.datagrams_to_send()[0][0]
+            self.listener.receive_datagram(ack, now, address)
+        # the least recently active connection makes room for the third
+        self.assertEqual(list(self.listener.connections), addresses[1:])
+        self.assertEqual(self.closed, addresses[:1])
+        self.assertEqual(self.listener.next_deadline(), 6.0)
+        self.listener.handle_timer(6.0)
+        self.assertEqual(list(self.listener.connections), addresses[2:])
+
+    def test_timers(self):
+        timed = []
+
+        class TimedServer(Server):
+            def handle_timer(self, now):
+                timed.append(self)
+                super().handle_timer(now)
+
+        self.listener.make_server = lambda: TimedServer(
+            None, 1, 10, 10, os.path.join(self.directory.name, "out.file"),
+        )
+        addresses = [("127.0.0.1", 10), ("127.0.0.1", 11)]
+        for now, address in zip((0.0, 0.5), addresses):
+            client = Client(None, b"", self.server_address, 100, 1, 10, "")
+            synack = self.handshake(client, address, now)
+            client.receive_datagram(synack, now, self.server_address)
+            for datagram, _ in client.datagrams_to_send():
+                self.listener.receive_datagram(datagram, now, address)
+            self.listener.datagrams_to_send()
+        # both wait for the ACK of their FIN-ACK
+        self.assertEqual(self.listener.next_deadline(), 1.0)
+        self.listener.handle_timer(1.0)
+        # only the expired connection is visited
+        self.assertEqual(timed, [self.listener.connections[addresses[0]]])
+        self.assertEqual(self.listener.next_deadline(), 1.5)
+
+
+class WriterTest(unittest.TestCase):
+    class Sink(io.BytesIO):
+        def __init__(self):
+            super().__init__()
+            self.unblocked = threading.Event()
+            self.contents = None
+
+        def write(self, data):
+            self.unblocked.wait()
+            if data == b"fail":
+                raise OSError("disk full")
+            return super().write(data)
+
+        def close(self):
+            self.contents = self.getvalue()
+            super().close()
+
+    def test_background(self):
+        sink = WriterTest.Sink()
+        latencies = []
+        writer = Writer(sink, latencies.append, depth=4)
+        for chunk in (b"a", b"b", b"c"):
+            writer.write(chunk)
+        # at most one chunk is taken by the blocked writer thread
+        self.assertGreaterEqual(writer.pending, 2)
+        sink.unblocked.set()
+        writer.close()
+        self.assertEqual(sink.contents, b"abc")
+        self.assertEqual(len(latencies), 3)
+
+    def test_full(self):
+        sink = WriterTest.Sink()
+        writer = Writer(sink, lambda seconds: None, depth=1)
+        while not writer.full:
+            writer.write(b"a")
+        # a full queue is refused instead of waited for
+        self.assertRaises(queue.Full, writer.write, b"b")
+        sink.unblocked.set()
+        writer.close()
+        self.assertNotIn(b"b", sink.contents)
+
+    def test_error(self):
+        sink = WriterTest.Sink()
+        sink.unblocked.set()
+        writer = Writer(sink, lambda seconds: None, depth=4)
+        writer.write(b"fail")
+        self.assertRaises(OSError, writer.close)
+
+
+class OptionsTest(unittest.TestCase):
+    def test_serialization_deserialization(self):
+        options = Options({Options.name: b"name", Options.cookie: b""})
+        self.assertEqual(Options.from_bytes(options.to_bytes()), options)
+
+    def test_truncated(self):
+        data = Options({Options.name: b"name"}).to_bytes()
+        self.assertRaises(InvalidFrame, Options.from_bytes, data[:-1])
+        self.assertRaises(InvalidFrame, Options.from_bytes, data[:2])
+
+
+class SessionWriterTest(unittest.TestCase):
+    def test_chunked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source")
+            os.makedirs(source)
+            for name, size in (("x", 5), ("y", 0), ("z", 3000)):
+                with open(os.path.join(source, name), "wb") as f:
+                    f.write(bytes(size))
+            stream = encode_files(source)
+            writer = SessionWriter(os.path.join(directory, "output"))
+            for i in range(0, len(stream), 7):
+                writer.write(stream[i:i + 7])
+            writer.close()
+            self.assertEqual(
+                [os.path.basename(path) for path in writer.completed],
+                ["x", "y", "z"]
+            )
+
+    def test_escape(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SessionWriter(directory)
+            self.assertRaises(
+                InvalidFrame, writer.write, b"\x00\x04\0\0\0\0\0\0\0\0../x"
+            )
+
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SessionWriter(directory)
+            writer.write(b"\x00\x01\0\0\0\0\0\0\0\x05xab")
+            self.assertRaises(InvalidFrame, writer.close)
+
+
+class ReceiveWindowTest(unittest.TestCase):
+    def test_free_space(self):
+        window = ReceiveWindow(10, 0.1)
+        self.assertEqual(window.advertise(0), 10)
+        self.assertEqual(window.advertise(4), 6)
+        self.assertEqual(window.advertise(10), 0)
+        self.assertEqual(ReceiveWindow(1000, 0.1).advertise(0), 255)
+
+    def test_drain_rate(self):
+        window = ReceiveWindow(100, 0.1)
+        window.record_drain(1, 0.01)
+        self.assertEqual(window.advertise(0), 10)
+        window.record_drain(1, 0.0001)
+        self.assertGreater(window.advertise(0), 10)
+        self.assertEqual(window.advertise(100), 0)
+
+
+class SimulationTest(unittest.TestCase):
+    def simulate(self, simulation: Simulation) -> dict:
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            return simulation.run()
+
+    def test_reproducible(self):
+        link = Impairment(loss=BernoulliLoss(0.05), delay=0.01, rate=1e6)
+        size = 50 * BTCPMessage.payload_size
+        result = self.simulate(Simulation(size, link, seed=3))
+        self.assertTrue(result["completed"])
+        self.assertTrue(result["correct"])
+        self.assertGreater(result["retransmissions"], 0)
+        self.assertEqual(
+            self.simulate(Simulation(size, link, seed=3)), result
+        )
+
+    def test_sequence_wrap(self):
+        class NearWrap(random.Random):
+            def randint(self, a, b):
+                if b == 2 ** 8:
+                    return sequence_space - 20
+                return super().randint(a, b)
+
+        simulation = Simulation(
+            50 * BTCPMessage.payload_size, Impairment(delay=0.01)
+        )
+        simulation.client.random = NearWrap(0)
+        result = self.simulate(simulation)
+        self.assertTrue(result["correct"])
+        self.assertEqual(result["retransmissions"], 0)
+        self.assertGreater(simulation.client.highest_ack, sequence_space)
+
+
+class AsyncioTest(unittest.TestCase):
+    def test_concurrent_uploads(self):
+        inputs = {
+            "a.file": os.urandom(30 * BTCPMessage.payload_size),
+            "b.file": os.urandom(10 * BTCPMessage.payload_size + 1),
+        }
+
+        async def transfer(directory):
+            server = await aio.start_server(("127.0.0.1", 0), directory)
+            async with server:
+                clients = asyncio.gather(*(
+                    aio.send_bytes(
+                        server.address, data, timeout=0.05,
+                        output_file=name,
+                    )
+                    for name, data in inputs.items()
+                ))
+                uploads = [await server.__anext__() for _ in inputs]
+                await clients
+                return [await upload.wait() for upload in uploads]
+
+        with tempfile.TemporaryDirectory() as directory:
+            uploads = asyncio.run(transfer(directory))
+            self.assertEqual(
+                sorted(os.path.basename(u.output_file) for u in uploads),
+                sorted(inputs)
+            )
+            for name, data in inputs.items():
+                with open(os.path.join(directory, name), "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_dropped_after_fin(self):
+        address = ("127.0.0.1", 1)
+        data = os.urandom(3 * BTCPMessage.payload_size)
+
+        async def upload(directory):
+            protocol = aio.ServerProtocol(
+                lambda: Server(None, 1, 10, 10, ""), directory,
+                asyncio.Queue(),
+            )
+            listener = protocol.listener
+            client = Client(None, data, ("127.0.0.1", 2), 100, 1, 10, "")
+            client.handle_timer(0.0)
+            for datagram, _ in client.datagrams_to_send():
+                listener.receive_datagram(datagram, 0.0, address)
+            for datagram, _ in listener.datagrams_to_send():
+                client.receive_datagram(datagram, 0.0, address)
+            ack, *segments = client.datagrams_to_send()
+            # the FIN arrives, but not the data before it
+            for datagram, _ in (ack, segments[-1]):
+                listener.receive_datagram(datagram, 0.0, address)
+            accepted = protocol.uploads.get_nowait()
+            listener.drop(address)
+            await accepted.wait()
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertRaises(
+                ConnectionError, asyncio.run, upload(directory)
+            )
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_iteration_ends(self):
+        async def collect(server):
+            return [upload async for upload in server]
+
+        async def iterate():
+            server = await aio.start_server(("127.0.0.1", 0))
+            uploads = asyncio.ensure_future(collect(server))
+            # closing wakes up an iteration that is already waiting
+            await asyncio.sleep(0)
+            server.close()
+            return await asyncio.wait_for(uploads, 5)
+
+        self.assertEqual(asyncio.run(iterate()), [])
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
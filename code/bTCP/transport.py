@@ -0,0 +1,109 @@
+import queue
+import socket
+
+from typing import Optional, Tuple
+
+Address = Tuple[str, int]
+
+
+class Transport(object):
+    """The datagram operations Client and Server use.
+
+    Timeouts behave like those of socket.socket: recv raises socket.timeout
+    when one expires, and BlockingIOError when non-blocking without data.
+    """
+
+    def sendto(self, data: bytes, address: Address) -> int:
+        raise NotImplementedError
+
+    def recvfrom(self, bufsize: int) -> Tuple[bytes, Address]:
+        raise NotImplementedError
+
+    def recv(self, bufsize: int) -> bytes:
+        return self.recvfrom(bufsize)[0]
+
+    def settimeout(self, timeout: Optional[float]):
+        raise NotImplementedError
+
+    def setblocking(self, flag: bool):
+        self.settimeout(None if flag else 0.0)
+
+    def close(self):
+        pass
+
+
+class UDPTransport(Transport):
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def sendto(self, data: bytes, address: Address) -> int:
+        return self.sock.sendto(data, address)
+
+    def recvfrom(self, bufsize: int) -> Tuple[bytes, Address]:
+        return self.sock.recvfrom(bufsize)
+
+    def recv(self, bufsize: int) -> bytes:
+        return self.sock.recv(bufsize)
+
+    def settimeout(self, timeout: Optional[float]):
+        self.sock.settimeout(timeout)
+
+    def setblocking(self, flag: bool):
+        self.sock.setblocking(flag)
+
+    def close(self):
+        self.sock.close()
+
+
+class LoopbackNetwork(object):
+    """Delivers datagrams between LoopbackTransports in one process."""
+
+    def __init__(self):
+        self.transports = {}
+
+    def transport(self, address: Address) -> "LoopbackTransport":
+        transport = LoopbackTransport(self, address)
+        self.transports[address] = transport
+        return transport
+
+    def pair(
+        self,
+        address_a: Address=("127.0.0.1", 1),
+        address_b: Address=("127.0.0.1", 2),
+    ) -> Tuple["LoopbackTransport", "LoopbackTransport"]:
+        return self.transport(address_a), self.transport(address_b)
+
+    def deliver(self, data: bytes, source: Address, destination: Address):
+        transport = self.transports.get(destination)
+        if transport is not None:
+            transport.inbox.put((data, source))
+
+
+class LoopbackTransport(Transport):
+    def __init__(self, network: LoopbackNetwork, address: Address):
+        self.network = network
+        self.address = address
+        self.inbox = queue.Queue()
+        self.timeout = None
+
+    def sendto(self, data: bytes, address: Address) -> int:
+        self.network.deliver(bytes(data), self.address, address)
+        return len(data)
+
+    def recvfrom(self, bufsize: int) -> Tuple[bytes, Address]:
+        try:
+            if self.timeout == 0:
+                data, address = self.inbox.get_nowait()
+            else:
+                data, address = self.inbox.get(timeout=self.timeout)
+        except queue.Empty:
+            if self.timeout == 0:
+                raise BlockingIOError()
+            raise socket.timeout("timed out")
+        return data[:bufsize], address
+
+    def settimeout(self, timeout: Optional[float]):
+        self.timeout = timeout
+
+    def close(self):
+        self.network.transports.pop(self.address, None)
@@ -0,0 +1,38 @@
+from typing import Optional
+
+
+class ReceiveWindow(object):
+    """Decides the window a receiver advertises.
+
+    capacity is the size of the reassembly buffer in segments. The
+    advertised window is the free part of the buffer, further limited to
+    what the sink is measured to drain within horizon seconds.
+    """
+    # window_size is a single byte in the header
+    limit = 2 ** 8 - 1
+
+    def __init__(
+        self,
+        capacity: int,
+        horizon: float,
+        smoothing: float=0.125,
+    ):
+        self.capacity = min(capacity, ReceiveWindow.limit)
+        self.horizon = horizon
+        self.smoothing = smoothing
+        self.drain_rate = None  # type: Optional[float]
+
+    def record_drain(self, segments: int, seconds: float):
+        if seconds <= 0:
+            return
+        rate = segments / seconds
+        if self.drain_rate is None:
+            self.drain_rate = rate
+        else:
+            self.drain_rate += self.smoothing * (rate - self.drain_rate)
+
+    def advertise(self, buffered: int) -> int:
+        free = max(0, self.capacity - buffered)
+        if self.drain_rate is not None:
+            free = min(free, max(1, int(self.drain_rate * self.horizon)))
+        return free
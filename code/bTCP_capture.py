@@ -0,0 +1,60 @@
+#!/usr/local/bin/python3
+import argparse
+import csv
+
+from bTCP.capture import Capture, read_capture, timelines
+
+# Handle arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("capture", help="Capture file to decode")
+parser.add_argument(
+    "--csv", help="Write the timelines to this CSV file for plotting",
+    type=str, default=None
+)
+args = parser.parse_args()
+
+
+def flag_names(header) -> str:
+    return "".join(
+        name if getattr(header, flag) else "."
+        for name, flag in (("S", "syn"), ("A", "ack"), ("F", "fin"),
+                           ("N", "name"), ("D", "session"),
+                           ("O", "options"))
+    )
+
+
+connections = timelines(read_capture(args.capture))
+rows = []
+for stream_id, events in connections.items():
+    start = events[0].timestamp
+    retransmissions = sum(event.retransmission for event in events)
+    print("stream {}: {} segments, {} retransmissions, {:.3f}s".format(
+        stream_id, len(events), retransmissions,
+        events[-1].timestamp - start,
+    ))
+    for event in events:
+        header = event.message.header
+        direction = "->" if event.direction == Capture.sent else "<-"
+        print(
+            "  {:10.6f} {} {} syn={:<5} ack={:<5} win={:<3} len={:<4}{}"
+            .format(
+                event.timestamp - start, direction, flag_names(header),
+                header.syn_number, header.ack_number, header.window_size,
+                header.data_length,
+                " retransmission" if event.retransmission else "",
+            )
+        )
+        rows.append((
+            stream_id, event.timestamp - start, direction, flag_names(header),
+            header.syn_number, header.ack_number, header.window_size,
+            header.data_length, int(event.retransmission),
+        ))
+
+if args.csv:
+    with open(args.csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow((
+            "stream", "time", "direction", "flags", "syn", "ack", "window",
+            "length", "retransmission",
+        ))
+        writer.writerows(rows)
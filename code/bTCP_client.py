@@ -1,8 +1,17 @@
 #!/usr/local/bin/python3
 import argparse
+import json
+import os
 import socket
 
+from bTCP import checksum
+from bTCP.capture import Capture, CapturingTransport
 from bTCP.client import Client
+from bTCP.fastopen import CookieCache
+from bTCP.pipeline import ReadAhead
+from bTCP.profiling import kinds, profile
+from bTCP.session import encode_files
+from bTCP.transport import UDPTransport
 
 # Handle arguments
 parser = argparse.ArgumentParser()
@@ -13,7 +22,11 @@ parser.add_argument(
     "-t", "--timeout", help="Define bTCP timeout in milliseconds", type=int,
     default=100
 )
-parser.add_argument("-i", "--input", help="File to send", default="tmp.file")
+parser.add_argument(
+    "-i", "--input",
+    help="File to send, or a directory to send all its files in one session",
+    default="tmp.file"
+)
 parser.add_argument(
     "-d", "--destination", help="Define destination IP", type=str,
     default="127.0.0.1"
@@ -29,25 +42,95 @@ parser.add_argument(
     "-r", "--retry", help="Define the retry limit when closing the connection",
     type=int, default=100
 )
+parser.add_argument(
+    "-c", "--capture", help="Record all datagrams to this capture file",
+    type=str, default=None
+)
+parser.add_argument(
+    "-f", "--fastopen",
+    help="Send data with the SYN, keeping server cookies in this file",
+    type=str, default=None
+)
+parser.add_argument(
+    "--stats", help="Write transfer statistics as JSON to this file",
+    type=str, default=None
+)
+parser.add_argument(
+    "-k", "--checksum",
+    help="Comma separated checksum algorithms to offer, most preferred first "
+    "(crc32, adler32, header)",
+    type=checksum.parse, default="crc32"
+)
+parser.add_argument(
+    "--read-ahead",
+    help="Segments to read and encode ahead in a background thread, 0 reads "
+    "the whole file first",
+    type=int, default=256
+)
+parser.add_argument(
+    "--profile",
+    help="Profile the run: time per state, cProfile or tracemalloc",
+    choices=kinds, default=None
+)
+parser.add_argument(
+    "--profile-output", help="Write the profile report to this file",
+    type=str, default=None
+)
 args = parser.parse_args()
 
-with open(args.input, "rb") as input:
-    input_bytes = input.read()
+session = os.path.isdir(args.input)
+read_ahead = None
+if session:
+    input_bytes = encode_files(args.input)
+elif args.read_ahead > 0:
+    input_bytes = b""
+    read_ahead = ReadAhead(open(args.input, "rb"), args.read_ahead)
+else:
+    with open(args.input, "rb") as input:
+        input_bytes = input.read()
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+transport = UDPTransport(sock)
+if args.capture:
+    transport = CapturingTransport(transport, Capture(args.capture))
+
+destination_address = (args.destination, args.port)
+cookies = CookieCache(args.fastopen) if args.fastopen else None
 
 client = Client(
-    sock=sock,
+    sock=transport,
     input_bytes=input_bytes,
-    destination_address=(args.destination, args.port),
+    destination_address=destination_address,
     window=args.window,
     timeout=args.timeout / 1000,
     retry_limit=args.retry,
     output_file=args.outputfile,
+    session=session,
+    fastopen=bool(args.fastopen),
+    fastopen_cookie=cookies.get(destination_address) if cookies else None,
+    checksums=args.checksum,
+    read_ahead=read_ahead,
 )
 
 try:
-    while client.state is not client.finished:
-        client.run()
+    with profile(args.profile, client, args.profile_output):
+        while client.state is not client.finished:
+            client.run()
 finally:
-    sock.close()
+    transport.close()
+    if read_ahead is not None:
+        read_ahead.close()
+
+if cookies and client.fastopen_cookie:
+    cookies.set(destination_address, client.fastopen_cookie)
+
+if args.stats:
+    with open(args.stats, "w") as f:
+        json.dump({
+            "bytes": (
+                os.path.getsize(args.input) if read_ahead else len(input_bytes)
+            ),
+            "segments_sent": client.segments_sent,
+            "retransmissions": client.retransmissions,
+            "transfer_seconds": client.transfer_time,
+        }, f)
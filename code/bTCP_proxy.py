@@ -0,0 +1,75 @@
+#!/usr/local/bin/python3
+import argparse
+import time
+
+from bTCP.impairment import (
+    BernoulliLoss, GilbertElliottLoss, ImpairmentProxy, profiles,
+)
+
+# Handle arguments
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-l", "--listenport", help="Define the port clients send to", type=int,
+    default=9000
+)
+parser.add_argument(
+    "-s", "--serverip", help="Define server IP", type=str,
+    default="127.0.0.1"
+)
+parser.add_argument(
+    "-p", "--serverport", help="Define server port", type=int, default=9001
+)
+parser.add_argument(
+    "--profile", help="Start from one of the testframework.py profiles",
+    choices=sorted(profiles()), default="ideal"
+)
+parser.add_argument("--seed", help="Random seed", type=int, default=0)
+parser.add_argument("--loss", help="Loss probability", type=float)
+parser.add_argument(
+    "--loss-correlation", help="Correlation of successive losses",
+    type=float, default=0.0
+)
+parser.add_argument(
+    "--gilbert-elliott", help="Burst loss model as P R [GOOD_LOSS BAD_LOSS]",
+    type=float, nargs="+", metavar="X"
+)
+parser.add_argument("--duplicate", help="Duplication probability", type=float)
+parser.add_argument("--corrupt", help="Bit flip probability", type=float)
+parser.add_argument("--delay", help="Delay in milliseconds", type=float)
+parser.add_argument("--jitter", help="Jitter in milliseconds", type=float)
+parser.add_argument("--reorder", help="Reorder probability", type=float)
+parser.add_argument(
+    "--reorder-correlation", help="Correlation of successive reorderings",
+    type=float
+)
+parser.add_argument("--rate", help="Bandwidth in bytes per second", type=float)
+args = parser.parse_args()
+if args.gilbert_elliott and len(args.gilbert_elliott) not in (2, 4):
+    parser.error("--gilbert-elliott takes 2 or 4 values")
+
+impairment = profiles()[args.profile]
+if args.loss is not None:
+    impairment.loss = BernoulliLoss(args.loss, args.loss_correlation)
+if args.gilbert_elliott:
+    impairment.loss = GilbertElliottLoss(*args.gilbert_elliott)
+for name in ("duplicate", "corrupt", "reorder", "reorder_correlation", "rate"):
+    if getattr(args, name) is not None:
+        setattr(impairment, name, getattr(args, name))
+for name in ("delay", "jitter"):
+    if getattr(args, name) is not None:
+        setattr(impairment, name, getattr(args, name) / 1000)
+
+proxy = ImpairmentProxy(
+    server_address=(args.serverip, args.serverport),
+    listen_address=("127.0.0.1", args.listenport),
+    impairment=impairment,
+    seed=args.seed,
+)
+proxy.start()
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    pass
+finally:
+    proxy.stop()
@@ -1,8 +1,16 @@
 #!/usr/local/bin/python3
 import argparse
+import json
+import os
 import socket
 
+from bTCP import checksum
+from bTCP.capture import Capture, CapturingTransport
+from bTCP.fastopen import load_key
+from bTCP.listener import Listener, upload_path
+from bTCP.profiling import kinds, profile
 from bTCP.server import Server
+from bTCP.transport import UDPTransport
 
 # Handle arguments
 parser = argparse.ArgumentParser()
@@ -14,7 +22,9 @@ parser.add_argument(
     default=100
 )
 parser.add_argument(
-    "-o", "--output", help="Where to store file", default="tmp.file"
+    "-o", "--output",
+    help="Where to store file, or the directory for a session's files",
+    default="tmp.file"
 )
 parser.add_argument(
     "-s", "--serverip", help="Define server IP", type=str,
@@ -28,21 +38,114 @@ parser.add_argument(
     "-r", "--retry", help="Define the retry limit when closing the connection",
     type=int, default=10
 )
+parser.add_argument(
+    "-c", "--capture", help="Record all datagrams to this capture file",
+    type=str, default=None
+)
+parser.add_argument(
+    "-f", "--fastopen-key",
+    help="Accept data with the SYN, using the cookie key in this file",
+    type=str, default=None
+)
+parser.add_argument(
+    "-k", "--checksums",
+    help="Comma separated checksum algorithms to accept "
+    "(crc32, adler32, header)",
+    type=checksum.parse, default="crc32,adler32"
+)
+parser.add_argument(
+    "-m", "--multi",
+    help="Keep serving any number of clients, storing uploads in the output "
+    "directory",
+    action="store_true"
+)
+parser.add_argument(
+    "--max-connections", help="Connections to keep in multi-client mode",
+    type=int, default=1024
+)
+parser.add_argument(
+    "--idle-timeout",
+    help="Seconds before an idle connection is dropped in multi-client mode",
+    type=float, default=30
+)
+parser.add_argument(
+    "--write-behind",
+    help="Segments to queue for a background writer thread, 0 writes them "
+    "in the receive loop",
+    type=int, default=255
+)
+parser.add_argument(
+    "--stats", help="Write transfer statistics as JSON to this file",
+    type=str, default=None
+)
+parser.add_argument(
+    "--profile",
+    help="Profile the run: time per state, cProfile or tracemalloc",
+    choices=kinds, default=None
+)
+parser.add_argument(
+    "--profile-output", help="Write the profile report to this file",
+    type=str, default=None
+)
 args = parser.parse_args()
+if args.multi and args.profile == "states":
+    parser.error("--profile states needs a single connection")
+if args.multi and args.stats:
+    parser.error("--stats needs a single connection")
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind((args.serverip, args.serverport))
+# tells scripts starting the server that it can receive
+print("S Listening on {}:{}".format(*sock.getsockname()), flush=True)
+transport = UDPTransport(sock)
+if args.capture:
+    transport = CapturingTransport(transport, Capture(args.capture))
+fastopen_key = load_key(args.fastopen_key) if args.fastopen_key else None
+
+
+def make_server(output_file: str=args.output) -> Server:
+    return Server(
+        sock=transport,
+        timeout=args.timeout / 1000,
+        retry_limit=args.retry,
+        window_size=args.window,
+        output_file=output_file,
+        fastopen_key=fastopen_key,
+        checksums=args.checksums,
+        write_behind=args.write_behind,
+    )
+
+
+def accept(address, server: Server):
+    server.output_file = upload_path(args.output, server)
+    print("S Accepted", address, "->", server.output_file)
 
-server = Server(
-    sock=sock,
-    timeout=args.timeout / 1000,
-    retry_limit=args.retry,
-    window_size=args.window,
-    output_file=args.output,
-)
 
 try:
-    while server.state is not server.finished:
-        server.run()
+    if args.multi:
+        os.makedirs(args.output, exist_ok=True)
+        listener = Listener(
+            transport, lambda: make_server(""), args.max_connections,
+            args.idle_timeout, on_accept=accept,
+        )
+        with profile(args.profile, listener, args.profile_output):
+            while True:
+                listener.run()
+    else:
+        server = make_server()
+        with profile(args.profile, server, args.profile_output):
+            while server.state is not server.finished:
+                server.run()
+except KeyboardInterrupt:
+    pass
 finally:
-    sock.close()
+    transport.close()
+
+if args.stats:
+    with open(args.stats, "w") as f:
+        json.dump({
+            "segments_written": server.writes,
+            "write_latency_p50": server.write_latency(0.5),
+            "write_latency_p99": server.write_latency(0.99),
+            "write_latency_max": server.write_latency(1.0),
+        }, f)
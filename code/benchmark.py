@@ -0,0 +1,255 @@
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+
+import filecmp
+
+from typing import List
+
+from bTCP.impairment import ImpairmentProxy, profiles
+
+units = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+metrics = {
+    # metric: (whether higher values are better, relative tolerance)
+    "goodput": (True, True),
+    "completion_time": (False, True),
+    "retransmission_ratio": (False, False),
+    "cpu_per_mb": (False, True),
+}
+directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_size(size: str) -> int:
+    size = size.upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_input(path: str, size: int, seed: int):
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        while size > 0:
+            chunk = min(size, 2 ** 20)
+            f.write(rng.getrandbits(chunk * 8).to_bytes(chunk, "little"))
+            size -= chunk
+
+
+def children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def start_server(arguments: List[str]) -> subprocess.Popen:
+    """Start bTCP_server.py and wait until it is ready to receive."""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(directory, "bTCP_server.py")] +
+        arguments,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    for line in server.stdout:
+        if line.startswith("S Listening"):
+            break
+    return server
+
+
+def run_transfer(
+    work_directory: str,
+    input_file: str,
+    window: int,
+    timeout: int,
+    profile: str,
+    seed: int,
+) -> dict:
+    """Transfer input_file once and measure it."""
+    output_file = os.path.join(work_directory, "out.file")
+    stats_file = os.path.join(work_directory, "stats.json")
+    server_port = free_port()
+    proxy = ImpairmentProxy(
+        ("127.0.0.1", server_port),
+        impairment=profiles(timeout / 1000)[profile],
+        seed=seed,
+    )
+    proxy.start()
+    cpu_before = children_cpu_time()
+    server = start_server([
+        "-o", output_file, "-w", str(window), "-t", str(timeout),
+        "-p", str(server_port),
+    ])
+    client = subprocess.run([
+        sys.executable, os.path.join(directory, "bTCP_client.py"),
+        "-i", input_file, "-w", str(window), "-t", str(timeout),
+        "-p", str(proxy.address[1]), "--stats", stats_file,
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+    server.stdout.close()
+    cpu_time = children_cpu_time() - cpu_before
+    proxy.stop()
+
+    size = os.path.getsize(input_file)
+    stats = {
+        "segments_sent": 0, "retransmissions": 0, "transfer_seconds": None,
+    }
+    if os.path.exists(stats_file):
+        with open(stats_file) as f:
+            stats = json.load(f)
+        os.remove(stats_file)
+    # measured by the client, from its first SYN to the server's FIN-ACK
+    completion_time = stats["transfer_seconds"]
+    correct = (
+        completion_time is not None and
+        client.returncode == 0 and
+        os.path.exists(output_file) and
+        filecmp.cmp(input_file, output_file, shallow=False)
+    )
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    if not correct:
+        completion_time = float("inf")
+    return {
+        "correct": correct,
+        "goodput": size / completion_time,
+        "completion_time": completion_time,
+        "retransmission_ratio": (
+            stats["retransmissions"] / max(1, stats["segments_sent"])
+        ),
+        "cpu_per_mb": cpu_time / max(size / 2 ** 20, 2 ** -20),
+    }
+
+
+def run_matrix(sizes, windows, timeouts, profile_names, repeat, seed):
+    results = []
+    with tempfile.TemporaryDirectory() as work_directory:
+        for size in sizes:
+            input_file = os.path.join(work_directory, "in.file")
+            write_input(input_file, size, seed)
+            for window, timeout, profile in itertools.product(
+                windows, timeouts, profile_names
+            ):
+                runs = [
+                    run_transfer(
+                        work_directory, input_file, window, timeout, profile,
+                        seed + i,
+                    )
+                    for i in range(repeat)
+                ]
+                result = {
+                    "size": size,
+                    "window": window,
+                    "timeout": timeout,
+                    "profile": profile,
+                    "correct": all(run["correct"] for run in runs),
+                }
+                for metric in metrics:
+                    values = sorted(run[metric] for run in runs)
+                    result[metric] = values[len(values) // 2]
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def key(result: dict) -> tuple:
+    return (
+        result["size"], result["window"], result["timeout"],
+        result["profile"],
+    )
+
+
+def regressions(results, baseline, tolerance: float):
+    """Compare results to a baseline and describe every regression."""
+    baseline = {key(result): result for result in baseline}
+    problems = []
+    for result in results:
+        if not result["correct"]:
+            problems.append("{}: transfer failed".format(key(result)))
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        for metric, (higher_is_better, relative) in metrics.items():
+            slack = old[metric] * tolerance if relative else tolerance
+            if higher_is_better:
+                regressed = result[metric] < old[metric] - slack
+            else:
+                regressed = result[metric] > old[metric] + slack
+            if regressed:
+                problems.append("{}: {} went from {:.6g} to {:.6g}".format(
+                    key(result), metric, old[metric], result[metric]
+                ))
+    return problems
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="bTCP benchmarks")
+    parser.add_argument(
+        "-s", "--sizes", help="File sizes to transfer, e.g. 1K 1M 2G",
+        nargs="+", default=["1K", "100K", "1M"]
+    )
+    parser.add_argument(
+        "-w", "--windows", help="Window sizes", type=int, nargs="+",
+        default=[100]
+    )
+    parser.add_argument(
+        "-t", "--timeouts", help="Timeouts in milliseconds", type=int,
+        nargs="+", default=[100]
+    )
+    parser.add_argument(
+        "-p", "--profiles", help="Impairment profiles", nargs="+",
+        choices=sorted(profiles()), default=["ideal", "lossy"]
+    )
+    parser.add_argument(
+        "-n", "--repeat", help="Runs per configuration, the median is used",
+        type=int, default=3
+    )
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", help="Write the results as JSON to this file"
+    )
+    parser.add_argument(
+        "-b", "--baseline", help="Fail if results regress from this file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Allowed regression, relative except for retransmission ratios",
+        type=float,
+        default=0.2
+    )
+    args = parser.parse_args()
+
+    results = run_matrix(
+        [parse_size(size) for size in args.sizes], args.windows,
+        args.timeouts, args.profiles, args.repeat, args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    baseline = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    problems = regressions(results, baseline, args.tolerance)
+    for problem in problems:
+        print("regression:", problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
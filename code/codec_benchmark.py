@@ -0,0 +1,139 @@
+import gc
+import json
+import sys
+import timeit
+import tracemalloc
+
+from bTCP import checksum
+from bTCP.message import BTCPMessage, MessageFactory
+from bTCP.header import BTCPHeader
+
+payload_sizes = (0, 100, 1000)
+
+
+def operations():
+    """Yield (name, callable) pairs for every measured codec operation."""
+    header = BTCPHeader(1, 2, 3, 0, 100)
+    header_bytes = header.to_bytes()
+    factory = MessageFactory(1, 100)
+    yield "header.to_bytes", header.to_bytes
+    yield "header.from_bytes", lambda: BTCPHeader.from_bytes(header_bytes)
+    yield "header.syn", lambda: header.syn
+    yield "header.no_flags", lambda: header.no_flags
+
+    def set_flags():
+        header.ack = True
+        header.ack = False
+    yield "header.ack=", set_flags
+    yield "factory.message", lambda: factory.message(2, 3, b"")
+    yield "factory.syn_message", lambda: factory.syn_message(2, 3, b"name")
+    yield "factory.ack_message", lambda: factory.ack_message(2, 3)
+    yield "factory.fin_message", lambda: factory.fin_message(2, 3)
+    yield "factory.synack_message", lambda: factory.synack_message(2, 3)
+    yield "factory.finack_message", lambda: factory.finack_message(2, 3)
+    for size in payload_sizes:
+        payload = bytes(size)
+        message = factory.message(2, 3, payload)
+        for name, identifier in checksum.names.items():
+            algorithm = checksum.algorithms[identifier]
+            # the default algorithm keeps the original operation names
+            suffix = "" if identifier == checksum.default else "," + name
+            data = message.to_bytes(algorithm)
+            yield "{}[{}]".format(algorithm.__name__, size), (
+                lambda algorithm=algorithm, payload=payload: algorithm(
+                    header_bytes, payload
+                )
+            )
+            yield "message.to_bytes[{}{}]".format(size, suffix), (
+                lambda algorithm=algorithm: message.to_bytes(algorithm)
+            )
+            yield "message.from_bytes[{}{}]".format(size, suffix), (
+                lambda algorithm=algorithm, data=data: BTCPMessage.from_bytes(
+                    data, algorithm
+                )
+            )
+            yield "round_trip[{}{}]".format(size, suffix), (
+                lambda algorithm=algorithm, payload=payload: (
+                    BTCPMessage.from_bytes(
+                        factory.message(2, 3, payload).to_bytes(algorithm),
+                        algorithm,
+                    )
+                )
+            )
+
+
+def allocations(operation, number: int=1000) -> dict:
+    """Measure the memory allocated while running operation."""
+    operation()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        operation()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        for _ in range(number):
+            operation()
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes_per_op": peak,
+        "retained_bytes_per_op": retained / (number + 1),
+    }
+
+
+def measure(operation, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    times = sorted(
+        time / number * 1e9 for time in timer.repeat(repeat, number)
+    )
+    result = {
+        "ns_per_op": times[0],
+        "median_ns_per_op": times[len(times) // 2],
+        "runs": repeat,
+        "ops_per_run": number,
+    }
+    result.update(allocations(operation))
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="bTCP codec benchmarks")
+    parser.add_argument(
+        "-r", "--repeat", help="Timing runs per operation", type=int,
+        default=7
+    )
+    parser.add_argument(
+        "-m", "--min-time", help="Approximate seconds per timing run",
+        type=float, default=0.2
+    )
+    parser.add_argument(
+        "-f", "--filter", help="Only run operations containing this string",
+        default=""
+    )
+    parser.add_argument(
+        "-o", "--output", help="Write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for name, operation in operations():
+        if args.filter not in name:
+            continue
+        results[name] = result = measure(
+            operation, args.repeat, args.min_time
+        )
+        print(
+            "{:<32} {:>10.1f} ns/op (median {:>10.1f}) {:>6} B peak".format(
+                name, result["ns_per_op"], result["median_ns_per_op"],
+                result["peak_bytes_per_op"],
+            ),
+            file=sys.stderr,
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,367 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional
+
+from benchmark import directory, free_port, parse_size
+from bTCP import aio
+from bTCP.client import Client
+from bTCP.impairment import ImpairmentProxy, profiles
+from bTCP.transport import Address, UDPTransport
+
+modes = ("threads", "processes", "asyncio")
+distributions = ("fixed", "exponential", "lognormal")
+
+
+class Connection(object):
+    """One client of a load run."""
+
+    def __init__(self, index: int, start: float, size: int, seed: int):
+        self.index = index
+        self.start = start
+        self.size = size
+        self.seed = seed
+        self.began = None  # type: Optional[float]
+        self.ended = None  # type: Optional[float]
+        self.finished = False
+
+    @property
+    def name(self) -> str:
+        return "conn-{}".format(self.index)
+
+    @property
+    def data(self) -> bytes:
+        rng = random.Random(self.seed)
+        return rng.getrandbits(self.size * 8).to_bytes(self.size, "little")
+
+    @property
+    def latency(self) -> float:
+        return self.ended - self.began
+
+
+def plan(
+    connections: int,
+    rate: float,
+    size: int,
+    distribution: str,
+    sigma: float,
+    seed: int,
+) -> List[Connection]:
+    """Draw start times from a Poisson process and sizes from distribution.
+
+    A rate of 0 starts every connection at once.
+    """
+    rng = random.Random(seed)
+    start = 0.0
+    planned = []
+    for index in range(connections):
+        if rate > 0 and index:
+            start += rng.expovariate(rate)
+        if distribution == "exponential":
+            drawn = rng.expovariate(1 / size)
+        elif distribution == "lognormal":
+            # size is the median
+            drawn = size * rng.lognormvariate(0, sigma)
+        else:
+            drawn = size
+        planned.append(Connection(index, start, int(drawn), seed + index))
+    return planned
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def memory(pid: int) -> Dict[str, int]:
+    """Read the resident set size of a process, in bytes."""
+    result = {}
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                result[name] = int(value.split()[0]) * 1024
+    return {
+        "server_rss": result.get("VmRSS", 0),
+        "server_peak_rss": result.get("VmHWM", 0),
+    }
+
+
+def run_client(
+    address: Address,
+    connection: Connection,
+    window: int,
+    timeout: int,
+    deadline: float,
+):
+    transport = UDPTransport(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    client = Client(
+        transport, connection.data, address, window, timeout / 1000, 100,
+        connection.name,
+    )
+    try:
+        while client.state is not client.finished:
+            if time.perf_counter() > deadline:
+                return
+            client.run()
+    finally:
+        transport.close()
+    connection.finished = True
+
+
+def run_threads(
+    address: Address,
+    connections: List[Connection],
+    window: int,
+    timeout: int,
+    limit: float,
+    work_directory: str,
+):
+    origin = time.perf_counter()
+
+    def run(connection: Connection):
+        time.sleep(max(0.0, origin + connection.start - time.perf_counter()))
+        connection.began = time.perf_counter()
+        run_client(
+            address, connection, window, timeout, connection.began + limit
+        )
+        connection.ended = time.perf_counter()
+    threads = [
+        threading.Thread(target=run, args=(connection,))
+        for connection in connections
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_processes(
+    address: Address,
+    connections: List[Connection],
+    window: int,
+    timeout: int,
+    limit: float,
+    work_directory: str,
+):
+    for connection in connections:
+        path = os.path.join(work_directory, connection.name)
+        with open(path, "wb") as f:
+            f.write(connection.data)
+    origin = time.perf_counter()
+
+    def run(connection: Connection):
+        time.sleep(max(0.0, origin + connection.start - time.perf_counter()))
+        connection.began = time.perf_counter()
+        try:
+            client = subprocess.run([
+                sys.executable, os.path.join(directory, "bTCP_client.py"),
+                "-i", os.path.join(work_directory, connection.name),
+                "-o", connection.name, "-w", str(window), "-t", str(timeout),
+                "-d", address[0], "-p", str(address[1]),
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                timeout=limit)
+            connection.finished = client.returncode == 0
+        except subprocess.TimeoutExpired:
+            pass
+        connection.ended = time.perf_counter()
+    threads = [
+        threading.Thread(target=run, args=(connection,))
+        for connection in connections
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_asyncio(
+    address: Address,
+    connections: List[Connection],
+    window: int,
+    timeout: int,
+    limit: float,
+    work_directory: str,
+):
+    async def run(connection: Connection):
+        await asyncio.sleep(connection.start)
+        connection.began = time.perf_counter()
+        try:
+            await asyncio.wait_for(aio.send_bytes(
+                address, connection.data, window, timeout / 1000,
+                output_file=connection.name,
+            ), limit)
+            connection.finished = True
+        except asyncio.TimeoutError:
+            pass
+        connection.ended = time.perf_counter()
+
+    async def run_all():
+        await asyncio.gather(*(
+            run(connection) for connection in connections
+        ))
+    asyncio.run(run_all())
+
+
+runners = {
+    "threads": run_threads,
+    "processes": run_processes,
+    "asyncio": run_asyncio,
+}  # type: Dict[str, Callable]
+
+
+def run_load(
+    mode: str,
+    connections: List[Connection],
+    window: int,
+    timeout: int,
+    profile: Optional[str],
+    limit: float,
+    max_connections: int,
+    seed: int,
+) -> dict:
+    with tempfile.TemporaryDirectory() as work_directory:
+        output = os.path.join(work_directory, "output")
+        server_port = free_port()
+        server = subprocess.Popen([
+            sys.executable, os.path.join(directory, "bTCP_server.py"),
+            "-m", "-o", output, "-w", str(window), "-t", str(timeout),
+            "-p", str(server_port),
+            "--max-connections", str(max_connections),
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        address = ("127.0.0.1", server_port)
+        proxy = None
+        if profile is not None:
+            proxy = ImpairmentProxy(
+                address, impairment=profiles(timeout / 1000)[profile],
+                seed=seed,
+            )
+            proxy.start()
+            address = proxy.address
+        time.sleep(0.5)
+        try:
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(devnull), \
+                    contextlib.redirect_stderr(devnull):
+                runners[mode](
+                    address, connections, window, timeout, limit,
+                    work_directory,
+                )
+            result = memory(server.pid)
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            if proxy is not None:
+                proxy.stop()
+        completed = []
+        for connection in connections:
+            path = os.path.join(output, connection.name)
+            if connection.finished and os.path.exists(path):
+                with open(path, "rb") as f:
+                    if f.read() == connection.data:
+                        completed.append(connection)
+
+    began = min(connection.began for connection in connections)
+    ended = max(connection.ended for connection in connections)
+    latencies = [connection.latency for connection in completed]
+    result.update({
+        "mode": mode,
+        "connections": len(connections),
+        "completed": len(completed),
+        "duration": ended - began,
+        "connections_per_second": len(completed) / (ended - began),
+        "goodput": sum(c.size for c in completed) / (ended - began),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+    })
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run many bTCP clients against one server"
+    )
+    parser.add_argument(
+        "-m", "--mode", help="How to run the clients", choices=modes,
+        default="asyncio"
+    )
+    parser.add_argument(
+        "-n", "--connections", help="Number of clients", type=int,
+        default=100
+    )
+    parser.add_argument(
+        "-r", "--rate",
+        help="Mean arrivals per second, 0 starts every client at once",
+        type=float, default=0
+    )
+    parser.add_argument(
+        "-s", "--size", help="Mean file size, or the median for lognormal",
+        default="100K"
+    )
+    parser.add_argument(
+        "-d", "--distribution", help="File size distribution",
+        choices=distributions, default="fixed"
+    )
+    parser.add_argument(
+        "--sigma", help="Shape of the lognormal distribution", type=float,
+        default=1.0
+    )
+    parser.add_argument(
+        "-p", "--profile", help="Impair the network with this profile",
+        choices=sorted(profiles()), default=None
+    )
+    parser.add_argument(
+        "-w", "--window", help="Window size", type=int, default=100
+    )
+    parser.add_argument(
+        "-t", "--timeout", help="Timeout in milliseconds", type=int,
+        default=100
+    )
+    parser.add_argument(
+        "-l", "--limit", help="Seconds after which a client gives up",
+        type=float, default=60
+    )
+    parser.add_argument(
+        "--max-connections", help="Connections the server keeps", type=int,
+        default=1024
+    )
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", help="Write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    result = run_load(
+        args.mode,
+        plan(
+            args.connections, args.rate, parse_size(args.size),
+            args.distribution, args.sigma, args.seed,
+        ),
+        args.window, args.timeout, args.profile, args.limit,
+        args.max_connections, args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    sys.exit(0 if result["completed"] == result["connections"] else 1)
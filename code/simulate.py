@@ -0,0 +1,90 @@
+import contextlib
+import json
+import os
+import sys
+import time
+
+from benchmark import parse_size
+from bTCP.impairment import BernoulliLoss, Impairment, profiles
+from bTCP.simulation import Simulation
+
+
+def simulate(
+    size: int,
+    impairment: Impairment,
+    window: int,
+    timeout: int,
+    seed: int,
+) -> dict:
+    """Simulate one transfer, silencing the protocol's own output.
+
+    Everything but cpu_seconds depends on the arguments only.
+    """
+    simulation = Simulation(
+        size, impairment, window=window, timeout=timeout / 1000, seed=seed,
+    )
+    start = time.process_time()
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        result = simulation.run()
+    result["cpu_seconds"] = time.process_time() - start
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Simulate a bTCP transfer on a virtual clock"
+    )
+    parser.add_argument(
+        "-s", "--size", help="File size to transfer, e.g. 1K 1M 1G",
+        default="10M"
+    )
+    parser.add_argument(
+        "-p", "--profile", help="Start from this impairment profile",
+        choices=sorted(profiles()), default="ideal"
+    )
+    parser.add_argument(
+        "-r", "--rate", help="Link rate in bytes per second", type=float,
+        default=12.5e6
+    )
+    parser.add_argument(
+        "-d", "--delay", help="One way delay in milliseconds", type=float,
+        default=10
+    )
+    parser.add_argument(
+        "-l", "--loss", help="Loss probability, overrides the profile's",
+        type=float, default=None
+    )
+    parser.add_argument(
+        "-w", "--window", help="Window size", type=int, default=100
+    )
+    parser.add_argument(
+        "-t", "--timeout", help="Timeout in milliseconds", type=int,
+        default=100
+    )
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", help="Write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    impairment = profiles(args.timeout / 1000)[args.profile]
+    impairment.rate = args.rate
+    impairment.delay = max(impairment.delay, args.delay / 1000)
+    if args.loss is not None:
+        impairment.loss = BernoulliLoss(args.loss) if args.loss else None
+
+    result = simulate(
+        parse_size(args.size), impairment, args.window, args.timeout,
+        args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    sys.exit(0 if result["correct"] else 1)
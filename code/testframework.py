@@ -5,12 +5,11 @@ import unittest
 
 import subprocess
 
+from bTCP.impairment import ImpairmentProxy, profiles
+
 timeout = 100
 winsize = 100
-intf = "lo"
-netem_add = "sudo tc qdisc add dev {} root netem".format(intf)
-netem_change = "sudo tc qdisc change dev {} root netem {}".format(intf, "{}")
-netem_del = "sudo tc qdisc del dev {} root netem".format(intf)
+server_address = ("127.0.0.1", 9001)
 
 
 def run_command(command, cwd=None, shell=True):
@@ -33,82 +32,88 @@ class TestbTCPFramework(unittest.TestCase):
     """Test cases for bTCP"""
 
     input_file = "tmp.file"
-    start_client = "python3 bTCP_client.py -i" + input_file
 
     def setUp(self):
         """Prepare for testing"""
-        # default netem rule (does nothing)
-        run_command_blocking(netem_add)
+        # userspace proxy between client and server (does nothing yet)
+        self.proxy = ImpairmentProxy(server_address)
+        self.proxy.start()
+        self.profiles = profiles(timeout / 1000)
 
         # launch localhost server
-        self.server_process = run_command("python3 bTCP_server.py -o out.file")
+        self.server_process = run_command(
+            "python3 bTCP_server.py -o out.file -w {} -t {} -p {}".format(
+                winsize, timeout, server_address[1]
+            )
+        )
+        self.start_client = (
+            "python3 bTCP_client.py -i {} -w {} -t {} -p {}".format(
+                TestbTCPFramework.input_file, winsize, timeout,
+                self.proxy.address[1],
+            )
+        )
 
     def tearDown(self):
         """Clean up after testing"""
         # clean the environment
-        run_command_blocking(netem_del)
-        os.remove("out.file")
-
         self.server_process.wait()
+        self.proxy.stop()
+        os.remove("out.file")
 
     def test_ideal_network(self):
         """reliability over an ideal framework"""
         # setup environment (nothing to set)
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_flipping_network(self):
         """reliability over network with bit flips
         (which sometimes results in lower layer packet loss)"""
         # setup environment
-        run_command_blocking(netem_change.format("corrupt 1%"))
+        self.proxy.impairment = self.profiles["flipping"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_duplicates_network(self):
         """reliability over network with duplicate packets"""
         # setup environment
-        run_command_blocking(netem_change.format("duplicate 10%"))
+        self.proxy.impairment = self.profiles["duplicates"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_lossy_network(self):
         """reliability over network with packet loss"""
         # setup environment
-        run_command_blocking(netem_change.format("loss 10% 25%"))
+        self.proxy.impairment = self.profiles["lossy"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_reordering_network(self):
         """reliability over network with packet reordering"""
         # setup environment
-        run_command_blocking(netem_change.format("delay 20ms reorder 25% 50%"))
+        self.proxy.impairment = self.profiles["reordering"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_delayed_network(self):
         """reliability over network with delay relative to the timeout value"""
         # setup environment
-        run_command_blocking(
-            netem_change.format("delay " + str(timeout) + "ms 20ms")
-        )
+        self.proxy.impairment = self.profiles["delayed"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
     def test_allbad_network(self):
         """reliability over network with all of the above problems"""
         # setup environment
-        run_command_blocking(netem_change.format(
-            "corrupt 1% duplicate 10% loss 10% 25% delay 20ms reorder 25% 50%"
-        ))
+        self.proxy.impairment = self.profiles["allbad"]
 
-        run_command_blocking(TestbTCPFramework.start_client)
+        run_command_blocking(self.start_client)
         self.assertTrue(filecmp.cmp(TestbTCPFramework.input_file, "out.file"))
 
 